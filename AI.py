@@ -1,51 +1,289 @@
+import time
+from collections import OrderedDict
+from reservation import ReservationTable
 from globs import *
 
+try: #numpy is optional, it's used only by the batch AI stage (see 'batch_turn')
+	import numpy
+	numpy_available = True
+except ImportError:
+	numpy_available = False
+
 #-----------------------------
 #~~~~~~~~~~~~~~~~~~~~~~~
-# BasicAI, ConfusedAI
+# BasicAI, ConfusedAI, Planner, perception
 # Here should lie everything related to NPC behaviour
 #~~~~~~~~~~~~~~~~~~~~~~~
 #-----------------------------
 
+def perceive(game):
+	"""
+		perception stage of the turn: decide, which enemies can see the player, for all of them at once
+		instead of computing FOV of every enemy, single field of view is computed from the player's position (and usually found in the cache):
+		lines of sight are (almost) symmetric, so an enemy sees the player, if it stands on one of the cells, visible to the player
+		dormant enemies on these cells are woken up, and active ones, that are too far and don't see the player, fall asleep,
+		so only enemies near the player are checked and take turns
+		while enemies see as far as the player, it's the player's own FOV, and only the cells, that have got into it since
+		the last perception, are checked for dormant enemies (see 'Player.take_fov_delta'): the rest of them have been woken up already
+	"""
+	player = game.player
+	level = game.location
+	level_map = level.level_map
+	if ENEMY_SIGHT_RADIUS == TORCH_RADIUS:
+		player.compute_fov()
+		visible = player.visible
+		level.wake_on_cells(player.take_fov_delta()[0])
+	else:
+		visible = level_map.visible_cells(level_map.get_fov_map(), player.pos.x, player.pos.y, ENEMY_SIGHT_RADIUS)
+		level.wake_on_cells(visible)
+	for char in list(level.active):
+		char.sees_player = level_map.index(char.pos.x, char.pos.y) in visible
+		if not char.sees_player and char.distance_to(player) > DORMANT_DISTANCE:
+			level.sleep(char)
+
+	if game.planner is not None:
+		game.planner.end_perception()
+
+class Planner:
+	"""
+		keeps AI work of a single frame within the time budget: planning (path search) is done right away only while there is time left,
+		otherwise characters make cheap reactive moves (i. e. down the old chase map) or wait for their paths,
+		and planning is postponed to the frames, when the player is idle (see 'idle')
+		perception (see 'perceive') can't be postponed, it's done first and takes its share of the budget, so it's measured separately
+		frames, that take longer than the budget anyway, are counted as overruns
+	"""
+	def __init__(self, budget = AI_FRAME_BUDGET):
+		"create planner with empty queue of postponed tasks"
+		self.budget = budget #seconds per frame
+		self.start = None #time of the beginning of the current frame, None outside of frames
+		self.pending = OrderedDict() #postponed tasks (function, args) with keys, so every thing is planned only once
+		#statistics: number of frames, frames longer than the budget, the longest frame (in seconds), postponed and completed tasks
+		self.frames = 0
+		self.overruns = 0
+		self.worst = 0.0
+		#the same for the perception stage of the frames: the longest one and the ones, that have taken the whole budget alone
+		self.perception_worst = 0.0
+		self.perception_overruns = 0
+		#idle frames are measured apart from the others: they aren't the player's turns, so they don't count as overruns
+		self.idle_frames = 0
+		self.idle_worst = 0.0
+		self.deferred = 0
+		self.completed = 0
+
+	def __getstate__(self):
+		"postponed tasks aren't saved: they are planned again, when they are needed"
+		state = self.__dict__.copy()
+		state['pending'] = OrderedDict()
+		state['start'] = None
+		return state
+
+	def start_frame(self):
+		self.start = time.time()
+
+	def end_frame(self):
+		"finish the frame and measure it"
+		elapsed = time.time() - self.start
+		self.start = None
+		self.frames += 1
+		self.worst = max(self.worst, elapsed)
+		if elapsed > self.budget:
+			self.overruns += 1
+
+	def end_perception(self):
+		"measure the perception stage, that has just finished; it's the first stage of the frame"
+		if self.start is not None:
+			elapsed = time.time() - self.start
+			self.perception_worst = max(self.perception_worst, elapsed)
+			if elapsed > self.budget:
+				self.perception_overruns += 1
+
+	def allows(self):
+		"True if there is time left for planning in the current frame (or outside of frames)"
+		return self.start is None or time.time() - self.start < self.budget
+
+	def defer(self, key, function, *args):
+		"postpone planning till the idle frame; the task with the same key replaces the older one"
+		self.pending.pop(key, None)
+		self.pending[key] = (function, args)
+		self.deferred += 1
+
+	def clear(self):
+		"forget postponed tasks, i. e. when the player leaves the level"
+		self.pending.clear()
+
+	def idle(self):
+		"perform postponed tasks, while there is time left in this idle frame; at least one task is done, so planning never stalls"
+		if not self.pending:
+			return
+		self.start_frame()
+		while self.pending:
+			(key, (function, args)) = self.pending.popitem(last = False)
+			function(*args)
+			self.completed += 1
+			if not self.allows():
+				break
+		self.idle_frames += 1
+		self.idle_worst = max(self.idle_worst, time.time() - self.start)
+		self.start = None
+
+	def report(self):
+		"statistics in a human-readable form"
+		return ('AI frames: %d, over the budget of %.1f ms: %d, the longest: %.1f ms, planning postponed: %d times, completed later: %d; '
+				'perception alone over the budget: %d, the longest: %.1f ms; idle frames: %d, the longest: %.1f ms' %
+				(self.frames, self.budget * 1000, self.overruns, self.worst * 1000, self.deferred, self.completed,
+				 self.perception_overruns, self.perception_worst * 1000, self.idle_frames, self.idle_worst * 1000))
+
+#the cell itself and the steps to the neighbouring cells in the same order, as 'LayeredMap.chase_step' checks them
+STEPS = ((0, 0), (-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+def batch_turn(game, actors):
+	"""
+		take turns of the actors, that act at the same time, all at once (see 'Scheduler.run'); returns their delays, like 'act' does
+		decisions of the characters with BasicAI are made together with numpy arrays: their distances to the player,
+		who attacks and who chases him, and the next steps down the chase map (see 'LayeredMap.chase_step');
+		then chasers claim the cells in the reservation table, the nearest to the player first, and all moves are made at once
+		other actors (i. e. confused characters, timed events) act one by one before them, as well as everybody without numpy;
+		chasers without a step down the chase map and characters, that don't see the player, but go to their goals (see 'BasicAI.search'),
+		walk along A* paths one by one after them
+	"""
+	if not numpy_available:
+		return [actor.act(game) for actor in actors]
+
+	delays = {}
+	batch = []
+	for actor in actors:
+		if isinstance(getattr(actor, 'ai', None), BasicAI):
+			batch.append(actor)
+		else:
+			delays[actor] = actor.act(game)
+	if batch:
+		batch_basic_ai(game, batch)
+		for char in batch:
+			delays[char] = char.action_time()
+	return [delays[actor] for actor in actors]
+
+def batch_basic_ai(game, chars):
+	"make decisions of BasicAI for all the characters together and perform them"
+	player = game.player
+	level_map = game.location.level_map
+	(x0, y0, width, height) = (level_map.x0, level_map.y0, level_map.width, level_map.height)
+
+	xs = numpy.array([char.pos.x for char in chars])
+	ys = numpy.array([char.pos.y for char in chars])
+	sees = numpy.array([char.sees_player for char in chars], dtype = bool)
+	distance = numpy.hypot(xs - player.pos.x, ys - player.pos.y)
+	attacking = numpy.flatnonzero(sees & (distance < 2))
+	chasing = numpy.flatnonzero(sees & (distance >= 2))
+
+	#everybody, who sees the player, remembers where he is, so it goes there, when he is out of sight (see 'BasicAI.search')
+	for i in numpy.flatnonzero(sees):
+		chars[i].goal = (player.pos.x, player.pos.y)
+
+	table = ReservationTable(level_map)
+	stuck = [] #chasers, that have no step down the chase map
+	if len(chasing):
+		#cells of the chasers (column 0) and their neighbours in the coordinates of the map layers
+		#cells of other chasers aren't blocked: they may be left during this turn (see 'ReservationTable.resolve')
+		steps = numpy.array(STEPS)
+		cell_x = (xs[chasing] - x0)[:, None] + steps[:, 0]
+		cell_y = (ys[chasing] - y0)[:, None] + steps[:, 1]
+		inside = (cell_x >= 0) & (cell_x < width) & (cell_y >= 0) & (cell_y < height)
+		cells = numpy.where(inside, cell_y * width + cell_x, 0)
+		walkable = numpy.frombuffer(level_map.walkable, dtype = numpy.uint8)[cells]
+		occupied = numpy.frombuffer(level_map.occupied, dtype = numpy.uint8)[cells]
+		movers = numpy.in1d(cells, cells[:, 0]).reshape(cells.shape)
+		blocked = ~inside | (walkable == 0) | ((occupied != 0) & ~movers)
+
+		#distances to the player on the chase map, shared by all chasers; unreachable cells are infinitely far
+		distances = numpy.where(inside, level_map.get_chase_distances(cells, player.pos.x, player.pos.y, game.planner), numpy.inf)
+		own = distances[:, 0]
+		candidates = numpy.where(blocked[:, 1:], numpy.inf, distances[:, 1:])
+		downhill = candidates < own[:, None]
+		order = numpy.argsort(candidates, axis = 1, kind = 'mergesort') #stable: equal cells are taken in the order of STEPS
+
+		#every chaser claims the cells down the chase map, the nearest ones to the player are served first
+		for row in range(len(chasing)):
+			char = chars[chasing[row]]
+			options = [int(cells[row, k + 1]) for k in order[row] if downhill[row, k]]
+			if options:
+				table.claim(char, options, own[row])
+			else: #nothing to step down to, go along A* path like 'Character.chase' does
+				stuck.append(char)
+	table.commit()
+
+	for char in stuck:
+		char.move_astar(player.pos.x, player.pos.y, game.planner)
+	for char in chars:
+		if not char.sees_player and char.goal is not None:
+			char.ai.search(game)
+
+	for i in attacking:
+		if player.fighter.hp > 0:
+			chars[i].fighter.attack(game, player)
+
 #following AIs are very primitive and should be improved
 
 class BasicAI:
 	"""
 		AI for a basic enemy
-		behaviour is simple: once in character is in the player's FOV it move towards him and beat him up
-		it can be improved by using character's FOV instead of only player's FOV
+		behaviour is simple: once the character sees the player (see 'perceive'), it moves towards him and beats him up
 	"""
 	def take_turn(self, game, player):
-		"go to the player and beat him up"
+		"go to the player and beat him up; when he is out of sight, go where he has been seen or heard the last time"
 		enemy = self.owner
-		if enemy.pos.is_in_fov:
+		if enemy.sees_player:
+			enemy.goal = (player.pos.x, player.pos.y)
 
 			#if the player is to far away - chase him
 			if enemy.distance_to(player) >= 2:
-				enemy.move_astar(player)
+				enemy.chase(player, game.planner)
 
 			#if he is near - attack him
 			elif player.fighter.hp > 0:
 				enemy.fighter.attack(game, player)
 
+		elif enemy.goal is not None:
+			self.search(game)
+
+	def search(self, game):
+		"walk to the goal of the owner (see 'Character.goal') along A* path; the goal is forgotten, when it's reached or can't be reached"
+		enemy = self.owner
+		(x, y) = enemy.goal
+		if enemy.distance(x, y) < 2 or not enemy.move_astar(x, y, game.planner):
+			enemy.goal = None
+
 class ConfusedAI:
 	"""
 		AI for a temporarily confused enemy (reverts to previous AI after a while)
 		just randomly fooling around for a few turns
+		the end of confusion is a timed event of the level's scheduler (see 'start')
 	"""
+	turn = None #number of the scheduled end of confusion (see 'Scheduler')
+
 	def __init__(self, old_ai, num_turns = CONFUSE_TURNS):
 		"initialize new AI"
 		self.old_ai = old_ai #previous character's AI, it will be restored after several turns
 		self.turns = num_turns #number of turns enemy is being confused
 
+	def start(self, game):
+		"schedule the end of confusion in the number of the owner's turns"
+		game.location.scheduler.schedule(self, self.turns * self.owner.action_time())
+
 	def take_turn(self, game, player):
 		"move in a random direction, ignoring player and everything"
-		if self.turns > 0:
-			dx = libtcod.random_get_int(0, -1, 1)
-			dy = libtcod.random_get_int(0, -1, 1)
-			self.owner.move(dx, dy)
-			self.turns -= 1
+		dx = libtcod.random_get_int(0, -1, 1)
+		dy = libtcod.random_get_int(0, -1, 1)
+		self.owner.move(dx, dy)
 
-		else:
-			self.owner.ai = self.old_ai
-			game.log.message('The ' + self.owner.name + ' is no longer confused!', libtcod.red)
+	def act(self, game):
+		"the confusion is over: restore the old AI; returns None, because it happens only once"
+		owner = self.owner
+		if owner.ai is self:
+			owner.ai = self.old_ai
+			if owner.fighter.hp > 0:
+				game.log.message('The ' + owner.name + ' is no longer confused!', libtcod.red)
+		else: #the owner has been confused again, before this confusion is over
+			ai = owner.ai
+			while ai.old_ai is not self:
+				ai = ai.old_ai
+			ai.old_ai = self.old_ai
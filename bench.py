@@ -0,0 +1,294 @@
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import character
+import gamemap
+import AI
+from gamelog import GameLog
+from globs import *
+
+try: #'resource' module is available only on Unix-like systems
+	import resource
+except ImportError:
+	resource = None
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# Benchmarks
+# Level generation, FOV and AI benchmarks; they don't need any window, so they can be run as 'python bench.py'
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+#measured phases of level generation in the order they happen
+#every phase is a tuple (name, owner, attribute): calls of 'owner.attribute' are timed
+PHASES = (('bsp_split', libtcod, 'bsp_split_recursive'),
+		  ('traverse', libtcod, 'bsp_traverse_inverted_level_order'),
+		  ('carve', gamemap.GameMap, 'carve'),
+		  ('build_room_index', gamemap.LayeredMap, 'build_room_index'),
+		  ('build_free_cells', gamemap.LayeredMap, 'build_free_cells'),
+		  ('place_enemies', gamemap.StationLevel, 'place_enemies'),
+		  ('init_fov', character.Character, 'init_fov'),
+		  ('place_items', gamemap.StationLevel, 'place_items'),
+		  ('place_stairs', gamemap.StationLevel, 'place_stairs'))
+
+class PhaseTimer:
+	"""
+		replaces the functions of the measured phases with wrappers, that accumulate time spent in every phase
+		nested phases are counted in both (i. e. 'init_fov' is a part of 'place_enemies')
+	"""
+	def __init__(self, phases = PHASES):
+		self.phases = phases
+		self.originals = []
+		self.reset()
+
+	def reset(self):
+		"start measuring new sample"
+		self.times = dict((name, 0.0) for (name, owner, attribute) in self.phases)
+		self.calls = dict((name, 0) for (name, owner, attribute) in self.phases)
+
+	def wrap(self, name, function):
+		"return function, that does the same as 'function', but measures its time"
+		def timed(*args, **kwargs):
+			start = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.times[name] += time.time() - start
+				self.calls[name] += 1
+		return timed
+
+	def install(self):
+		for (name, owner, attribute) in self.phases:
+			original = owner.__dict__[attribute]
+			self.originals.append((owner, attribute, original))
+			setattr(owner, attribute, self.wrap(name, original))
+
+	def uninstall(self):
+		for (owner, attribute, original) in self.originals:
+			setattr(owner, attribute, original)
+		self.originals = []
+
+def percentile(values, fraction):
+	"nearest-rank percentile of the list of numbers"
+	ordered = sorted(values)
+	if not ordered:
+		return None
+	rank = int(round(fraction * len(ordered) + 0.5)) - 1
+	return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+def time_stats(times):
+	"p50/p95/p99 of the list of times in seconds as a dict {'p50': milliseconds, ...}"
+	return dict(('p%d' % p, round(percentile(times, p / 100.0) * 1000, 3)) for p in (50, 95, 99))
+
+def peak_memory():
+	"""
+		peak resident memory of the whole process in kilobytes since its start, or None if it's unknown
+		it's the maximum over all sizes, measured so far, so only the first size shows its own peak
+	"""
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin': #bytes on Mac OS
+		peak /= 1024
+	return peak
+
+def generate_sample(timer, level, seed, size, chunked):
+	"generate single level and return its measurements as a dict"
+	gc.collect()
+	objects_before = len(gc.get_objects())
+	timer.reset()
+
+	start = time.time()
+	station_level = gamemap.StationLevel(level, seed, chunked, size)
+	total = time.time() - start
+
+	objects_after = len(gc.get_objects())
+	sample = {'seed': seed,
+			  'total': total,
+			  'phases': dict(timer.times),
+			  'calls': dict(timer.calls),
+			  'rooms': len(station_level.level_map.rooms),
+			  'characters': len(station_level.characters),
+			  'items': len(station_level.items),
+			  'objects': objects_after - objects_before}
+
+	station_level.release_fov()
+	return sample
+
+def summarize(samples):
+	"p50/p95/p99 (in milliseconds) of the total time and every phase, and median numbers of objects"
+	summary = {'levels': len(samples), 'total_ms': time_stats([s['total'] for s in samples]), 'phases_ms': {}}
+	for (name, owner, attribute) in PHASES:
+		summary['phases_ms'][name] = time_stats([s['phases'][name] for s in samples])
+	for key in ('objects', 'characters', 'items', 'rooms'):
+		summary[key] = percentile([s[key] for s in samples], 0.5)
+	summary['process_peak_memory_kb'] = peak_memory()
+	return summary
+
+def run(levels, sizes, first_seed, chunked, level = 10):
+	"generate 'levels' levels of every size and return results, ready to be saved as JSON"
+	timer = PhaseTimer()
+	timer.install()
+	results = {'levels': levels, 'first_seed': first_seed, 'chunked': chunked, 'python': sys.version.split()[0], 'sizes': []}
+	try:
+		for size in sizes:
+			samples = [generate_sample(timer, level, seed, size, chunked) for seed in range(first_seed, first_seed + levels)]
+			results['sizes'].append({'size': '%dx%d' % size, 'summary': summarize(samples), 'samples': samples})
+	finally:
+		timer.uninstall()
+	return results
+
+def print_results(results):
+	"print short table with percentiles of every phase"
+	for entry in results['sizes']:
+		summary = entry['summary']
+		print 'map %s, %d levels, ~%d objects per level, peak memory of the process so far %s KB' % (entry['size'], summary['levels'], summary['objects'], summary['process_peak_memory_kb'])
+		print '    %-18s %10s %10s %10s' % ('phase (ms)', 'p50', 'p95', 'p99')
+		rows = [(name, summary['phases_ms'][name]) for (name, owner, attribute) in PHASES] + [('total', summary['total_ms'])]
+		for (name, stats) in rows:
+			print '    %-18s %10.3f %10.3f %10.3f' % (name, stats['p50'], stats['p95'], stats['p99'])
+
+#FOV engines, compared by the FOV benchmark, as tuples (name, engine, libtcod algorithm)
+FOV_ENGINES = (('libtcod basic', 'libtcod', libtcod.FOV_BASIC),
+			   ('libtcod diamond', 'libtcod', libtcod.FOV_DIAMOND),
+			   ('libtcod shadow', 'libtcod', libtcod.FOV_SHADOW),
+			   ('libtcod permissive', 'libtcod', libtcod.FOV_PERMISSIVE_4),
+			   ('libtcod restrictive', 'libtcod', libtcod.FOV_RESTRICTIVE),
+			   ('shadowcasting', 'shadowcasting', FOV_ALGO))
+
+def run_fov(positions, sizes, radii, seed):
+	"""
+		compute FOV from 'positions' random floor cells of a level of every size with every engine and radius
+		every computation includes reading visible cells back, as the game does; the cache of the map is bypassed
+	"""
+	results = {'positions': positions, 'seed': seed, 'python': sys.version.split()[0], 'fov': []}
+	for size in sizes:
+		rng = libtcod.random_new_from_seed(seed)
+		level_map = gamemap.GameMap(rng, *size)
+		libtcod.random_delete(rng)
+
+		floor = [i for i in range(level_map.width * level_map.height) if level_map.walkable[i]]
+		cells = random.Random(seed).sample(floor, min(positions, len(floor)))
+		fov_map = level_map.get_fov_map()
+
+		for radius in radii:
+			for (name, engine, algo) in FOV_ENGINES:
+				(times, visible) = ([], 0)
+				for i in cells:
+					(x, y) = (i % level_map.width, i / level_map.width)
+					level_map.fov_cache = None
+					start = time.time()
+					visible += len(level_map.visible_cells(fov_map, x, y, radius, FOV_LIGHT_WALLS, algo, engine))
+					times.append(time.time() - start)
+
+				summary = time_stats(times)
+				summary['visible_cells'] = visible / len(cells)
+				results['fov'].append({'size': '%dx%d' % size, 'radius': radius, 'engine': name, 'summary': summary})
+		level_map.release_fov_map()
+	return results
+
+def print_fov_results(results):
+	"print short table with percentiles of every engine"
+	print '%-10s %6s  %-20s %10s %10s %10s %8s' % ('map', 'radius', 'engine (ms)', 'p50', 'p95', 'p99', 'visible')
+	for entry in results['fov']:
+		summary = entry['summary']
+		print '%-10s %6d  %-20s %10.3f %10.3f %10.3f %8d' % (entry['size'], entry['radius'], entry['engine'],
+															  summary['p50'], summary['p95'], summary['p99'], summary['visible_cells'])
+
+class AIBenchGame:
+	"the smallest stand-in for GameState, that lets enemies take their turns"
+	def __init__(self, location, player):
+		self.location = location
+		self.player = player
+		self.log = GameLog()
+		self.game_state = 'playing'
+		self.planner = None #planning is never postponed, so both AI stages do the same work
+
+#AI stages, compared by the AI benchmark, as tuples (name, batch function for 'Scheduler.run')
+AI_STAGES = (('reference', None),
+			 ('batch', AI.batch_turn))
+
+def run_ai(counts, turns, size, seed):
+	"""
+		let 'count' awake enemies of every number in 'counts' chase the player, that stands still, for 'turns' turns
+		with every AI stage; every stage starts with the same level, and enemies always see the player
+	"""
+	results = {'turns': turns, 'seed': seed, 'size': '%dx%d' % size, 'numpy': AI.numpy_available,
+			   'python': sys.version.split()[0], 'ai': []}
+	for count in counts:
+		for (name, batch) in AI_STAGES:
+			station_level = gamemap.StationLevel(FIRST_LEVEL, seed, False, size)
+			level_map = station_level.level_map
+			(x, y) = station_level.get_player_start_pos()
+			player = character.generate_player(station_level, x, y)
+			player.fighter.hp = player.fighter.max_hp = 10 ** 9
+
+			#add enemies on random free cells, until there are enough of them, and wake them all
+			rng = random.Random(seed)
+			free = [i for i in range(level_map.width * level_map.height) if not level_map.is_blocked(i)]
+			for i in rng.sample(free, max(0, min(count - len(station_level.characters), len(free)))):
+				character.generate_enemy(station_level, i % level_map.width + level_map.x0, i / level_map.width + level_map.y0, rng.randrange(len(character.CHAR_DICT)))
+			for char in station_level.characters[:count]:
+				station_level.wake(char)
+
+			game = AIBenchGame(station_level, player)
+			times = []
+			for turn in range(turns):
+				for char in station_level.active:
+					char.sees_player = True
+				start = time.time()
+				station_level.scheduler.run(game, player.action_time(), batch)
+				times.append(time.time() - start)
+			station_level.release_fov()
+
+			summary = time_stats(times)
+			summary['adjacent'] = sum(1 for char in station_level.active if char.distance_to(player) < 2)
+			summary['goals'] = sum(1 for char in station_level.active if char.goal == (player.pos.x, player.pos.y)) #must be the same for every stage
+			results['ai'].append({'enemies': len(station_level.active), 'stage': name, 'summary': summary})
+	return results
+
+def print_ai_results(results):
+	"print short table with percentiles of turn time of every AI stage"
+	print 'map %s, %d turns, numpy %s' % (results['size'], results['turns'], 'available' if results['numpy'] else 'not available')
+	print '%8s  %-10s %10s %10s %10s %9s %6s' % ('enemies', 'stage (ms)', 'p50', 'p95', 'p99', 'adjacent', 'goals')
+	for entry in results['ai']:
+		summary = entry['summary']
+		print '%8d  %-10s %10.3f %10.3f %10.3f %9d %6d' % (entry['enemies'], entry['stage'], summary['p50'], summary['p95'], summary['p99'],
+														  summary['adjacent'], summary['goals'])
+
+def parse_size(text):
+	"'100x80' -> (100, 80)"
+	(width, height) = text.lower().split('x')
+	return (int(width), int(height))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Measure level generation of Breakdown.')
+	parser.add_argument('-n', '--levels', type = int, default = 20, help = 'number of levels of every size (one per seed)')
+	parser.add_argument('-s', '--sizes', default = '%dx%d' % (MAP_WIDTH, MAP_HEIGHT), help = 'comma separated map sizes, like 100x80,200x160')
+	parser.add_argument('--seed', type = int, default = 1, help = 'seed of the first level')
+	parser.add_argument('--chunked', action = 'store_true', help = 'generate chunked levels')
+	parser.add_argument('--fov', action = 'store_true', help = 'measure FOV engines instead of level generation')
+	parser.add_argument('-r', '--radii', default = '5,%d,20' % TORCH_RADIUS, help = 'comma separated FOV radii (0 is unlimited)')
+	parser.add_argument('-p', '--positions', type = int, default = 200, help = 'number of viewpoints for the FOV benchmark')
+	parser.add_argument('--ai', action = 'store_true', help = 'compare AI stages instead of level generation')
+	parser.add_argument('-e', '--enemies', default = '50,200,500', help = 'comma separated numbers of enemies for the AI benchmark')
+	parser.add_argument('-t', '--turns', type = int, default = 50, help = 'number of turns for the AI benchmark')
+	parser.add_argument('-o', '--output', default = 'bench_results.json', help = 'file for the results in JSON format')
+	args = parser.parse_args()
+
+	sizes = [parse_size(size) for size in args.sizes.split(',')]
+	if args.fov:
+		results = run_fov(args.positions, sizes, [int(radius) for radius in args.radii.split(',')], args.seed)
+		print_fov_results(results)
+	elif args.ai:
+		results = run_ai([int(count) for count in args.enemies.split(',')], args.turns, sizes[0], args.seed)
+		print_ai_results(results)
+	else:
+		results = run(args.levels, sizes, args.seed, args.chunked)
+		print_results(results)
+	with open(args.output, 'w') as output:
+		json.dump(results, output, indent = 1, sort_keys = True)
+	print 'Results are saved to ' + args.output
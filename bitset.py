@@ -0,0 +1,100 @@
+from binascii import hexlify, unhexlify
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# Bitset
+# Packed map layer with one bit per cell
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+class Bitset:
+	"""
+		packed set of flags, one bit per cell; it's used as a map layer, so it can be indexed like bytearray
+		flags are stored in bytearray, 8 cells per byte: cell 'i' is the bit 'i % 8' of the byte 'i / 8'
+		set operations (&, |, -, ~) work on whole bitsets at once, and the bitset is pickled as a single string
+	"""
+	def __init__(self, size, data = None):
+		"create bitset for 'size' cells, all flags are cleared, unless packed 'data' is given"
+		self.size = size
+		if data is None:
+			self.data = bytearray((size + 7) / 8)
+		else:
+			self.data = bytearray(data)
+
+	def __getstate__(self):
+		return (self.size, str(self.data))
+
+	def __setstate__(self, state):
+		(self.size, data) = state
+		self.data = bytearray(data)
+
+	def __len__(self):
+		return self.size
+
+	def __getitem__(self, i):
+		"flag of the cell 'i' (0 or 1); slice returns bytearray with a byte per cell"
+		if isinstance(i, slice):
+			return bytearray(self[j] for j in xrange(*i.indices(self.size)))
+		return (self.data[i >> 3] >> (i & 7)) & 1
+
+	def __setitem__(self, i, value):
+		"set or clear the flag of the cell 'i'; slice can be set from any sequence of flags"
+		if isinstance(i, slice):
+			for (j, flag) in zip(xrange(*i.indices(self.size)), value):
+				self[j] = flag
+		elif value:
+			self.data[i >> 3] |= 1 << (i & 7)
+		else:
+			self.data[i >> 3] &= ~(1 << (i & 7)) & 0xff
+
+	def __eq__(self, other):
+		return isinstance(other, Bitset) and self.size == other.size and self.data == other.data
+
+	def __ne__(self, other):
+		return not self == other
+
+	#set operations are performed on long integers, made of the whole bitsets
+	def to_long(self):
+		if not self.data:
+			return 0L
+		return long(hexlify(str(self.data[::-1])), 16)
+
+	def from_long(self, value):
+		"new bitset of the same size with flags taken from the bits of the long integer"
+		value &= (1L << self.size) - 1
+		return Bitset(self.size, unhexlify('%0*x' % (len(self.data) * 2, value))[::-1])
+
+	def __and__(self, other):
+		return self.from_long(self.to_long() & other.to_long())
+
+	def __or__(self, other):
+		return self.from_long(self.to_long() | other.to_long())
+
+	def __sub__(self, other):
+		"flags, that are set in this bitset, but not in the other one (i. e. newly seen = visible - explored)"
+		return self.from_long(self.to_long() & ~other.to_long())
+
+	def __invert__(self):
+		return self.from_long(~self.to_long())
+
+	def count(self):
+		"number of set flags"
+		return bin(self.to_long()).count('1')
+
+	def indexes(self):
+		"list of cells with set flags"
+		result = []
+		for (i, byte) in enumerate(self.data):
+			if byte:
+				result.extend(i * 8 + bit for bit in range(8) if byte >> bit & 1)
+		return result
+
+	def set_all(self):
+		"set flags of all cells at once"
+		self.data = bytearray([0xff]) * len(self.data)
+		if self.size % 8:
+			self.data[-1] = (1 << self.size % 8) - 1
+
+	def clear_all(self):
+		"clear flags of all cells at once"
+		self.data = bytearray(len(self.data))
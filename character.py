@@ -14,13 +14,25 @@ class Character(Object):
 	"""
 		class derived from Object, representing any in-game character (excluding player)
 		unlike Object instances, characters can move, attack and have access to the map
-		every character possesses its own FOV map
+		characters use FOV map, that is shared by the whole level; only the ones, that need FOV of their own, get a private copy
 	"""
-	def __init__(self, tile, map, char, color, name, fighter, ai = None):
-		"create new character"
+	own_fov = False #if True, the character gets a private copy of the level's FOV map
+	sees_player = False #set by the perception stage of every turn (see 'AI.perceive')
+	awake = False #only awake characters take turns (see 'StationLevel.wake')
+	turn = None #number of the scheduled turn (see 'Scheduler')
+	fov = None #private FOV map (libtcod map), if the character has one
+	path = None #libtcod path, that is reused by every call of 'move_astar'
+	path_map = None #FOV map, the path has been created for
+	last_room = None #index of the room, where the character has been the last time (it's used while it walks through tunnels)
+	goal = None #point (x, y), the character goes to, while it doesn't see the player: where it has seen or heard him the last time
+	blocked = () #cells (x, y) of the path, where others have stood in the way, since the character has moved the last time
+	waited = 0 #number of turns, the character has waited for the way to be cleared (see 'wait_in_line')
+
+	def __init__(self, tile, map, char, color, name, fighter, ai = None, speed = NORMAL_SPEED):
+		"create new character; character with higher speed takes turns more often"
 		Object.__init__(self, tile, char, color, name, blocks_path = True, always_visible = False)
 
-		self.entire_map = map #GameMap instance, map of the current level
+		self.entire_map = map #GameMap instance, map of the current level (can be addressed as 'entire_map[x][y]')
 
 		self.fighter = fighter #Fighter instance
 		self.fighter.owner = self #create the reference to this character from its own Fighter component
@@ -28,71 +40,260 @@ class Character(Object):
 		self.ai = ai #on of the AIs instance
 		if self.ai:
 			self.ai.owner = self
+		self.speed = speed
 
 		self.inventory = [] #list of items, that this character carries
 		self.equipment = {'weapon': None, 
 						  'armor': None} #equipment, matters only to the player
 
-		self.init_fov() #compute personal FOV for this character
+		self.init_fov() #prepare FOV for this character
+
+	def action_time(self):
+		"units of time, that single action takes for this character"
+		return ACTION_TIME * NORMAL_SPEED / self.speed
+
+	def act(self, game):
+		"take the turn, scheduled by the level's scheduler; returns the time until the next turn"
+		self.ai.take_turn(game, game.player)
+		return self.action_time()
 
 	def init_fov(self):
-		"generate FOV map for this character"
+		"prepare FOV for this character; private FOV map is copied from the level's shared one"
 		self.fov_recompute = True #indicates, if FOV should be recomputed; changes to True when character moves
-
-		#create FOV map, according to the level map
-		self.fov = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-		for x in range(MAP_WIDTH):
-			for y in range(MAP_HEIGHT):
-				libtcod.map_set_properties(self.fov, x, y, self.entire_map[x][y].transparent, not self.entire_map[x][y].is_blocked())
+		self.visible = None #frozenset of indexes of the cells, visible after the last computation
+
+		#FOV map covers the same area as map layers, so its coordinates are shifted by (x0, y0) relative to the level
+		self.release_fov()
+		if self.own_fov:
+			level_map = self.entire_map
+			self.fov = libtcod.map_new(level_map.width, level_map.height)
+			libtcod.map_copy(level_map.get_fov_map(), self.fov)
+			self.fov_revision = level_map.journal.revision #revision of the map's journal, the private FOV map is up to date with
+
+	def release_fov(self):
+		"delete private FOV map of this character and its path, that depend on the level's maps"
+		if self.fov is not None:
+			libtcod.map_delete(self.fov)
+			self.fov = None
+		self.release_path()
+
+	def get_fov_map(self):
+		"FOV map, used by this character: its private one (brought up to date with the changes of the map) or the one, shared by the level"
+		level_map = self.entire_map
+		if self.fov is None:
+			return level_map.get_fov_map()
+
+		if self.fov_revision != level_map.journal.revision:
+			self.fov_revision = level_map.update_fov_map(self.fov, self.fov_revision)
+		return self.fov
 
 	def compute_fov(self): #for now this function is used only in the Player's 'compute_fov, but it can come in handy when redoing current enemies detecting system'
-		"calculate FOV for this character, perform"
+		"calculate FOV for this character; indexes of the visible cells are kept in 'visible'"
 		if self.fov_recompute:
 			self.fov_recompute = False
-			libtcod.map_compute_fov(self.fov, self.pos.x, self.pos.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+			self.visible = self.entire_map.visible_cells(self.get_fov_map(), self.pos.x, self.pos.y)
 
 	def move(self, dx, dy):
 		"""
 			move by the given amount, if the destination is not blocked
 			returns True if movement was successfull, False if it wasn't
 		"""
-		destination = self.entire_map[self.pos.x + dx][self.pos.y + dy]
+		(x, y) = (self.pos.x + dx, self.pos.y + dy)
+		if not self.entire_map.contains(x, y): #the edge of the active part of the map
+			return False
+
+		destination = self.entire_map[x][y]
 		if not destination.is_blocked():
 			self.pos.occupied = False
-			self.pos = destination
-			if self.blocks_path:
-				self.pos.occupied = True
-			self.fov_recompute = True
+			self.step_to(destination)
 			return True
 			
 		else:
 			return False
 
-	def move_towards(self, target_x, target_y):
-		"move towards certain point, destination is calculated on the fly"
+	def step_to(self, destination):
+		"put the character on the destination tile without any checks; the old tile should be freed by the caller"
+		self.pos = destination
+		if self.blocks_path:
+			self.pos.occupied = True
+		self.fov_recompute = True
+		#the ones, who have stood in the way (see 'move_astar'), are left behind, however the character has moved
+		self.blocked = ()
+		self.waited = 0
+
+	def towards(self, target_x, target_y):
+		"direction (dx, dy) of the straight step towards certain point"
 		dx = target_x - self.pos.x
 		dy = target_y - self.pos.y
 		distance = sqrt(dx ** 2 + dy ** 2) #as simple, as it is
+		return (int(round(dx / distance)), int(round(dy / distance)))
 
-		dx = int(round(dx / distance))
-		dy = int(round(dy / distance))
-		self.move(dx, dy)
+	def move_towards(self, target_x, target_y):
+		"move towards certain point, destination is calculated on the fly"
+		self.move(*self.towards(target_x, target_y))
 
-	def move_astar(self, target): #it is not perfect, but it really works
-		"perform move towards 'target' using A* pathfinding algorithm"
+	def compute_path(self, x, y, avoid = ()):
+		"""
+			compute A* path to the point (x, y) and start walking it from the beginning; libtcod path is created only once and then reused
+			cells (x, y) in 'avoid' are taken as walls during the search, i. e. the ones, where somebody stands in the way
+		"""
+		level_map = self.entire_map
+		fov_map = level_map.get_fov_map()
+		if self.path_map is not fov_map: #the shared FOV map has been recreated
+			self.release_path()
+			self.path = libtcod.path_new_using_map(fov_map, 1.41)
+			self.path_map = fov_map
+
+		#FOV map coordinates are relative to the top-left corner of map layers
+		for (cell_x, cell_y) in avoid:
+			i = level_map.index(cell_x, cell_y)
+			libtcod.map_set_properties(fov_map, cell_x - level_map.x0, cell_y - level_map.y0, level_map.transparent[i], False)
+		libtcod.path_compute(self.path, self.pos.x - level_map.x0, self.pos.y - level_map.y0, x - level_map.x0, y - level_map.y0)
+		for (cell_x, cell_y) in avoid:
+			i = level_map.index(cell_x, cell_y)
+			libtcod.map_set_properties(fov_map, cell_x - level_map.x0, cell_y - level_map.y0, level_map.transparent[i], level_map.walkable[i])
+		self.path_cursor = 0 #index of the next step of the path
+		self.path_start = (self.pos.x, self.pos.y) #the point, the path starts at (it isn't a step of the path)
+		self.path_end = (x, y) #the point, the path leads to
+		self.path_revision = level_map.journal.layer_revision(*level_map.TERRAIN_LAYERS)
+
+	def plan_path(self, x, y, avoid = ()):
+		"postponed path search (see 'AI.Planner'); characters, that have fallen asleep or died meanwhile, don't need it"
+		if self.awake:
+			self.compute_path(x, y, avoid)
+
+	def release_path(self):
+		"delete the path, because the FOV map, it has been created for, is gone"
+		if self.path is not None:
+			libtcod.path_delete(self.path)
+			self.path = None
+			self.path_map = None
+
+	def next_path_step(self):
+		"the next cell of the path as a tuple (x, y) in level coordinates, or None if the path is over"
+		if self.path_cursor >= libtcod.path_size(self.path):
+			return None
+		(x, y) = libtcod.path_get(self.path, self.path_cursor)
+		return (x + self.entire_map.x0, y + self.entire_map.y0)
+
+	def move_astar(self, target_x, target_y, planner = None): #it is not perfect, but it really works
+		"""
+			perform move towards the point (target_x, target_y) using A* pathfinding algorithm; returns False if it can't be reached
+			far targets are reached room by room: the route is found over the graph of rooms (see 'LayeredMap.waypoint'),
+			and A* is used only to cross the current and the next room, so long paths cost as much as short ones
+			the path is kept between the turns and computed again only if the target has moved too far from its end,
+			the next step lies aside, the path is over or the terrain has changed; other characters on the way are walked around,
+			and if it's impossible, the path is computed again, so it goes around everybody, who has stood in the way, and the character waits;
+			new paths go around everybody next to the character at once, so the path is computed once, while the character is stuck in the crowd,
+			instead of every turn, and after PATH_PATIENCE turns of waiting the character gives up (returns False)
+			if 'planner' (AI.Planner) has no time left in this frame, the search is postponed, and the character waits for it:
+			the straight step would lead into the wall, and the step down the chase map has been tried by the chasers already (see 'chase')
+		"""
 		#description can be found in 'python+libtcod roguelike' article
-		path = libtcod.path_new_using_map(self.fov, 1.41)
+		level_map = self.entire_map
+		if not level_map.connected(self.pos.x, self.pos.y, target_x, target_y): #there is no need to search
+			return False
+		room = level_map.room_at(self.pos.x, self.pos.y)
+		if room is not None:
+			self.last_room = room
+		(x, y) = level_map.waypoint(self.last_room, target_x, target_y)
+
+		#the character could have left the path by other means (i. e. confused), then the step isn't next to it, unless it has come back
+		outdated = (self.path is None or self.path_map is not level_map.get_fov_map() or
+					self.path_revision != level_map.journal.layer_revision(*level_map.TERRAIN_LAYERS) or
+					max(abs(x - self.path_end[0]), abs(y - self.path_end[1])) > PATH_DRIFT)
+		#the path, that goes around the ones, who stand in the way, may be over at once: they have closed the way, so it isn't computed again
+		step = None if outdated else self.next_path_step()
+		if step is not None and max(abs(step[0] - self.pos.x), abs(step[1] - self.pos.y)) > 1 and self.return_to_path():
+			step = self.next_path_step()
+		if outdated or (step is None and not self.blocked) or (step is not None and max(abs(step[0] - self.pos.x), abs(step[1] - self.pos.y)) > 1):
+			if planner is not None and not planner.allows():
+				planner.defer(('path', id(self)), self.plan_path, x, y, self.blocked)
+				return True
+			self.block_neighbours((x, y))
+			self.compute_path(x, y, self.blocked)
+			step = self.next_path_step()
+
+		#the target itself is the last step of the path, it may be blocked (i. e. by the chased character), but the path is fine
+		if step is None: #the point can't be reached, at least while others stand in the way
+			return self.wait_in_line() if self.blocked else False
+		if step != (target_x, target_y):
+			if self.move(step[0] - self.pos.x, step[1] - self.pos.y) or self.step_around():
+				self.path_cursor += 1
+			else:
+				if step not in self.blocked: #somebody new stands in the way, so the path has to go around everybody next to the character
+					self.blocked += (step,)
+					self.block_neighbours((x, y))
+					if planner is not None and not planner.allows():
+						planner.defer(('path', id(self)), self.plan_path, x, y, self.blocked)
+					else:
+						self.compute_path(x, y, self.blocked)
+				return self.wait_in_line()
+		return True
+
+	def wait_in_line(self):
+		"wait a turn, while others stand in the way; after PATH_PATIENCE turns they are forgotten, and False is returned: the way is closed"
+		self.waited += 1
+		if self.waited < PATH_PATIENCE:
+			return True
+		self.blocked = ()
+		self.waited = 0
+		return False
 
-		libtcod.path_compute(path, self.pos.x, self.pos.y, target.pos.x, target.pos.y)
+	def return_to_path(self):
+		"""
+			the character, that has left its path (i. e. by the step down the chase map), but is back on it, goes on from there;
+			returns True if it stands on the path or at its start
+		"""
+		if (self.pos.x, self.pos.y) == self.path_start:
+			self.path_cursor = 0
+			return True
+		(x, y) = (self.pos.x - self.entire_map.x0, self.pos.y - self.entire_map.y0)
+		for k in range(libtcod.path_size(self.path)):
+			if libtcod.path_get(self.path, k) == (x, y):
+				self.path_cursor = k + 1
+				return True
+		return False
+
+	def block_neighbours(self, end):
+		"""
+			add the cells around the character, where others stand, to the ones, that its path should go around (see 'blocked');
+			the end of the path (x, y) isn't blocked: it may be the chased character itself
+		"""
+		level_map = self.entire_map
+		for (dx, dy) in ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+			(x, y) = (self.pos.x + dx, self.pos.y + dy)
+			if level_map.contains(x, y) and level_map.occupied[level_map.index(x, y)] and (x, y) not in self.blocked and (x, y) != end:
+				self.blocked += ((x, y),)
 
-		if not libtcod.path_is_empty(path) and libtcod.path_size(path) < 25:
-			x, y = libtcod.path_walk(path, True)
-			if x or y:
-				self.move(x - self.pos.x, y - self.pos.y)
-		else:
-			self.move_towards(target.pos.x, target.pos.y)
+	def step_around(self):
+		"""
+			go around another character, that stands on the next step of the path: move to a free cell, that is next
+			to the step after it, so the path isn't computed again (A* knows only about walls); returns True on success
+		"""
+		self.path_cursor += 1
+		step = self.next_path_step()
+		self.path_cursor -= 1
+		if step is None:
+			return False
 
-		libtcod.path_delete(path)
+		for (dx, dy) in ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+			(x, y) = (self.pos.x + dx, self.pos.y + dy)
+			if max(abs(step[0] - x), abs(step[1] - y)) <= 1 and self.move(dx, dy):
+				return True
+		return False
+
+	def chase(self, target, planner = None):
+		"""
+			step towards 'target' down the chase map of the level, that is shared by all characters, chasing the same target
+			if there is no step down (i. e. the way is blocked by others), the character goes room by room along A* path (see 'move_astar'),
+			and while it's stuck in the crowd, it waits instead of searching the path every turn
+		"""
+		step = self.entire_map.chase_step(self.pos.x, self.pos.y, target.pos.x, target.pos.y, planner)
+		if step is not None:
+			self.move(*step)
+		else:
+			self.move_astar(target.pos.x, target.pos.y, planner)
 
 	def add_item(self, item):
 		"add an item to the characters inventory"
@@ -122,6 +323,7 @@ class Fighter:
 		"reduces character's health by some value; call 'death_function' upon character's death"
 		if damage > 0:
 			self.hp -= damage
+			game.location.wake(self.owner)
 
 			if self.hp <= 0:
 				if self.death_function is not None:
@@ -134,8 +336,9 @@ class Fighter:
 			self.hp = self.max_hp
 
 	def attack(self, game, target): #primitive damage-calculating scheme should be redone completely
-		"one character attacks another"
+		"one character attacks another; noise of the fight wakes up dormant characters around"
 		damage = self.power - target.fighter.defense
+		game.location.make_noise(self.owner.pos.x, self.owner.pos.y)
 
 		if damage > 0:
 			game.log.message(self.owner.name.capitalize() + ' attacks ' + target.name + ' for ' + str(damage) + ' hit points!')
@@ -145,6 +348,7 @@ class Fighter:
 
 class Player(Character):
 	"class that represents unique character - player"
+	own_fov = True #player's FOV is kept between turns, so it needs a map of its own
 	def __init__(self, tile, map, char, color, name, fighter):
 		"construct Player instance"
 		Character.__init__(self, tile, map, char, color, name, fighter)
@@ -176,27 +380,54 @@ class Player(Character):
 				game.log.message("You can't go there.", libtcod.light_grey)
 				self.state = 'idle'
 
+	def init_fov(self):
+		"prepare FOV for the player; the first computation checks all cells of the map"
+		Character.init_fov(self)
+		self.fov_delta = (set(), set()) #indexes of cells, that have got into FOV and out of it since the delta was taken (see 'take_fov_delta')
+
 	def compute_fov(self):
-		"similar to character's 'compute_fov', but also marks all visible tiles: tile.is_in_fov = True"
+		"""
+			similar to character's 'compute_fov', but also marks all visible tiles: tile.is_in_fov = True
+			only cells, that have changed their visibility, are updated; they are added to 'fov_delta' as sets of indexes (shown, hidden)
+		"""
 		if self.fov_recompute:
 			self.fov_recompute = False
-			libtcod.map_compute_fov(self.fov, self.pos.x, self.pos.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-			
-			for y in range(MAP_HEIGHT):
-				for x in range(MAP_WIDTH):
-					visible = libtcod.map_is_in_fov(self.fov, x, y)
-					if visible: #tile is in the player's FOV
-						self.entire_map[x][y].explored = True
-						self.entire_map[x][y].is_in_fov = True
-					else:
-						self.entire_map[x][y].is_in_fov = False
+			level_map = self.entire_map
+			visible = level_map.visible_cells(self.get_fov_map(), self.pos.x, self.pos.y)
 
+			if self.visible is None: #there may be visible cells all over the map before the first computation
+				old_visible = frozenset(level_map.in_fov.indexes())
+				self.fov_delta = (set(visible), set()) #everything is new for the ones, who take the delta
+			else:
+				old_visible = self.visible
+
+			#changes are recorded in the map's journal, so the screen is updated only where it's needed
+			(shown, hidden) = (visible - old_visible, old_visible - visible)
+			set_cell = level_map.set_cell
+			for i in shown:
+				set_cell('in_fov', i, True)
+				if not level_map.explored[i]:
+					set_cell('explored', i, True)
+			for i in hidden:
+				set_cell('in_fov', i, False)
+
+			self.visible = visible
+			#cells, that have changed back since the delta was taken, are not in it anymore
+			(all_shown, all_hidden) = self.fov_delta
+			self.fov_delta = ((all_shown - hidden) | (shown - all_hidden), (all_hidden - shown) | (hidden - all_shown))
+
+	def take_fov_delta(self):
+		"return the sets of indexes (shown, hidden) of the cells, that have got into FOV and out of it since the last call"
+		delta = self.fov_delta
+		self.fov_delta = (set(), set())
+		return delta
 
 
 def enemy_death(game, char):
 	"the event of enemy's death"
 	game.log.message(char.name.capitalize() + ' is dead!', libtcod.orange)
 	char.pos.occupied = False
+	char.release_fov()
 
 	#place character's remains on his last position
 	if char.name == 'robo-miner':
@@ -204,7 +435,7 @@ def enemy_death(game, char):
 	elif char.name  == 'robo-guard':
 		add_item_to_lvl(game.location, char.pos.x, char.pos.y, 5)
 
-	game.location.characters.remove(char)
+	game.location.remove_character(char)
 	del char
 
 def player_death(game, player): #too simple
@@ -222,9 +453,9 @@ def generate_enemy(station_level, x, y, char_id):
 	char = CHAR_DICT[char_id] #explanations below
 	fighter_component = Fighter(char['hp'], char['def'], char['pow'], char['exp'], char['death'])
 	ai_component = char['ai']()
-	enemy = Character(local_map[x][y], local_map, char['icon'], char['color'], char['name'], fighter_component, ai_component)
+	enemy = Character(local_map[x][y], local_map, char['icon'], char['color'], char['name'], fighter_component, ai_component, char['speed'])
 	
-	station_level.characters.append(enemy)
+	station_level.add_character(enemy)
 
 def generate_player(station_level, x, y):
 	"construct Player instance and put it on the map"
@@ -240,6 +471,7 @@ def generate_player(station_level, x, y):
 # some properties description:
 #	'death' is a function that is called when character dies
 #	'ai' is an AI.* instance
+#	'speed' is how often character takes turns (NORMAL_SPEED is the player's speed)
 #
 #current characters: 'robo-guard' and 'robo-miner'
 #
@@ -248,8 +480,8 @@ def generate_player(station_level, x, y):
 #'char_id' used in 'generate_enemy' is an index of a character in 'CHAR_DICT'
 
 miner = {'hp': 50, 'def': 0, 'pow': 10, 'exp': 25, 'death': enemy_death, 'ai': AI.BasicAI,
-		 'icon': 'm', 'color': libtcod.light_cyan, 'name': 'robo-miner'}
+		 'icon': 'm', 'color': libtcod.light_cyan, 'name': 'robo-miner', 'speed': NORMAL_SPEED}
 guard = {'hp': 75, 'def': 5, 'pow': 20, 'exp': 100, 'death': enemy_death, 'ai': AI.BasicAI,
-		 'icon': 'G', 'color': libtcod.darkest_han, 'name': 'robo-guard'}
+		 'icon': 'G', 'color': libtcod.darkest_han, 'name': 'robo-guard', 'speed': NORMAL_SPEED}
 
 CHAR_DICT = (miner, guard)
@@ -1,5 +1,5 @@
 from genericobject import Object
-from random import choice
+from interface import show_progress
 from globs import *
 
 #-----------------------------
@@ -12,7 +12,7 @@ class Environment(Object):
 	"""
 		class derived from Object, that represents any background objects: stairs, doors, etc.
 		each Environment object can interact with player once it press the right button
-		for now only stairs exist
+		for now only stairs exist: '<' leads to the next level of the station, '>' leads back to the previous one
 	"""
 	def __init__(self, tile, char, color, name, blocks_path = False, always_visible = True, interaction = None):
 		"create new background object"
@@ -24,19 +24,27 @@ class Environment(Object):
 		if self.interaction is not None:
 			self.interaction(game)
 
-def generate_object(station_level): #for now it only constructs down stairs
-	"construct new Environment object"
+def generate_object(station_level, rng, rooms): #for now it only constructs stairs to the next level
+	"construct new Environment object in one of the 'rooms', the room is chosen with libtcod random generator 'rng'"
 	local_map = station_level.level_map
 	
-	room = choice(local_map.rooms)
+	room = local_map.starting_room
 	while room == local_map.starting_room:
-		room = choice(local_map.rooms)
+		room = rooms[libtcod.random_get_int(rng, 0, len(rooms) - 1)]
 
 	(x, y) = room.center()
 	
 	obj = Environment(local_map.map_grid[x][y], '<', libtcod.white, 'stairs', interaction = next_level)
 	station_level.environment.append(obj)
 
+def generate_back_stairs(station_level):
+	"construct stairs to the previous level at the center of the starting room, where the player arrives"
+	local_map = station_level.level_map
+	(x, y) = local_map.starting_room.center()
+
+	obj = Environment(local_map.map_grid[x][y], '>', libtcod.white, 'stairs down', interaction = previous_level)
+	station_level.environment.append(obj)
+
 def next_level(game):
 	"advance to the next game level, 'interact' function for stairs"
 	#heal the player by 50%
@@ -44,18 +52,53 @@ def next_level(game):
 	game.player.fighter.heal(game.player.fighter.max_hp / 2)
 
 	game.log.message('After a rare moment of peace, you ascend the stairs shaft, hoping to get out of this cursed place...', libtcod.lighter_green)
+	change_level(game, game.location.level - 1, 'Climbing the stairs shaft')
 
-	#reconstruct level
-	game.location.__init__(game.location.level - 1)
-	
-	#place player in one of the rooms
-	local_map = game.location.level_map
-	(player_x, player_y) = game.location.get_player_start_pos()
-	game.player.pos = local_map.map_grid[player_x][player_y]
+def previous_level(game):
+	"return to the level, the player came from, 'interact' function for stairs down"
+	game.log.message('You climb down the stairs shaft to the level you have already been on.', libtcod.lighter_green)
+	change_level(game, game.location.level + 1, 'Climbing down the stairs shaft')
+
+def change_level(game, number, progress_text):
+	"""
+		move the player to the level with certain number
+		the current level is kept in the list of visited ones, so it stays the same, when the player comes back
+		the player arrives at the stairs, that lead back to the level, that has just been left
+	"""
+	player = game.player
+	old_level = game.location
+	player.pos.occupied = False
+	player.release_fov()
+	game.planner.clear()
+	game.levels.store(old_level)
+
+	#take the visited level or the one, that has been generated in the background
+	new_level = game.levels.take(number)
+	if new_level is None:
+		def waiting(seconds):
+			show_progress(progress_text, seconds)
+		new_level = game.pregen.get(number, waiting)
+	game.location = new_level
+
+	#start preparing the following level, unless it has been visited already
+	if number - 1 not in game.levels:
+		game.pregen.request(number - 1)
+
+	#place player near the stairs, that lead back, or in the starting room
+	back_interaction = previous_level if number < old_level.level else next_level
+	(player_x, player_y) = new_level.get_player_start_pos()
+	for obj in new_level.environment:
+		if obj.interaction is back_interaction:
+			(player_x, player_y) = (obj.pos.x, obj.pos.y)
+			break
+	new_level.update_active_area(player_x, player_y)
+
+	local_map = new_level.level_map
+	player.pos = local_map.map_grid[player_x][player_y]
+	player.pos.occupied = True
 
 	libtcod.console_clear(game.consols['map'])
-	for char in game.location.characters:
-		char.init_fov()
-	game.player.entire_map = local_map.map_grid
-	game.player.init_fov()
-	game.player.state = 'acted'
+	game.rendered = None
+	player.entire_map = local_map.map_grid
+	player.init_fov()
+	player.state = 'acted'
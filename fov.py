@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from globs import *
+
+try: #numpy is optional, it's used only to present visibility as a 2D array
+	import numpy
+	numpy_available = True
+except ImportError:
+	numpy_available = False
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# FOVCache, shadowcasting engine
+# Functions, related to computing field of view of the characters
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+#transformations of coordinates (xx, xy, yx, yy) from the first octant to each of the eight octants
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+		   (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+def shadowcast(transparent, width, height, x, y, radius = 0, light_walls = True):
+	"""
+		compute field of view from the point (x, y) by recursive shadowcasting right on the transparency layer of the map
+		'transparent' is a sequence of width * height flags (like the layer of LayeredMap), x and y are indexes in it;
+		radius 0 means unlimited field of view, 'light_walls' makes visible opaque cells, that border visible area
+		returns a tuple (visibility, cells): bytearray of the same size with 1 for every visible cell and list of their indexes
+	"""
+	visibility = bytearray(width * height)
+	origin = y * width + x
+	visibility[origin] = 1
+	cells = [origin]
+
+	if radius <= 0:
+		radius = max(width, height)
+	radius_squared = radius * radius
+
+	def cast(row, start, end, xx, xy, yx, yy):
+		"scan rows of the octant starting with 'row', that are visible between slopes 'start' and 'end'"
+		if start < end:
+			return
+
+		for distance in xrange(row, radius + 1):
+			dy = -distance
+			blocked = False
+			for dx in xrange(-distance, 1):
+				#slopes of the left and the right edges of the cell
+				left_slope = (dx - 0.5) / (dy + 0.5)
+				right_slope = (dx + 0.5) / (dy - 0.5)
+				if start < right_slope:
+					continue
+				elif end > left_slope:
+					break
+
+				#the cell is opaque, if it's out of the map
+				(cell_x, cell_y) = (x + dx * xx + dy * xy, y + dx * yx + dy * yy)
+				if 0 <= cell_x < width and 0 <= cell_y < height:
+					i = cell_y * width + cell_x
+					opaque = not transparent[i]
+					if dx * dx + dy * dy <= radius_squared and not visibility[i] and (light_walls or not opaque):
+						visibility[i] = 1
+						cells.append(i)
+				else:
+					opaque = True
+
+				if blocked:
+					if opaque:
+						new_start = right_slope
+					else:
+						blocked = False
+						start = new_start
+				elif opaque and distance < radius:
+					#the cell casts a shadow: scan the part of the next row above it separately
+					blocked = True
+					cast(distance + 1, start, left_slope, xx, xy, yx, yy)
+					new_start = right_slope
+			if blocked:
+				break
+
+	for (xx, xy, yx, yy) in OCTANTS:
+		cast(1, 1.0, 0.0, xx, xy, yx, yy)
+	return (visibility, cells)
+
+def as_array(visibility, width, height):
+	"present visibility, returned by 'shadowcast', as 2D boolean numpy array without copying, if numpy is available"
+	if not numpy_available:
+		return visibility
+	return numpy.frombuffer(visibility, dtype = numpy.bool_).reshape(height, width)
+
+class FOVCache:
+	"""
+		bounded storage of already computed fields of view; the least recently used one is dropped, when it's full
+		every field of view is a frozenset of indexes of visible cells, and its key is a tuple
+		(x, y, radius, light_walls, algo, revision), where 'revision' is the revision of the map's transparency
+		and 'algo' is the libtcod algorithm or the name of another engine
+	"""
+	def __init__(self, size = FOV_CACHE_SIZE):
+		"create empty cache, that holds up to 'size' fields of view"
+		self.size = size
+		self.entries = OrderedDict() #the most recently used field of view is the last
+		#number of lookups, that have found the field of view and that haven't
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key):
+		"return the field of view with certain key, or None if it isn't stored"
+		visible = self.entries.pop(key, None)
+		if visible is None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		self.entries[key] = visible
+		return visible
+
+	def put(self, key, visible):
+		"store computed field of view, dropping the least recently used one, if there is no space left"
+		if key in self.entries:
+			del self.entries[key]
+		elif len(self.entries) >= self.size:
+			self.entries.popitem(last = False)
+		self.entries[key] = visible
+
+	def clear(self):
+		"forget all fields of view, i. e. when the map has changed its position"
+		self.entries.clear()
@@ -1,12 +1,25 @@
 import random
+import zlib
+import heapq
+from math import sqrt
+from array import array
 from character import generate_enemy
-from environment import generate_object
+from environment import generate_object, generate_back_stairs
 from item import add_item_to_lvl
+from fov import FOVCache, shadowcast
+from journal import ChangeJournal
+from bitset import Bitset
+from scheduler import Scheduler
 from globs import *
 
+try: #numpy is optional, it's used only by the batch AI stage (see 'AI.batch_turn')
+	import numpy
+except ImportError:
+	numpy = None
+
 #-----------------------------
 #~~~~~~~~~~~~~~~~~~~~~~~
-# StationLevel, GameMap, Tile, Rectangle
+# StationLevel, GameMap, ChunkedMap, Tile, Rectangle
 # May conatain functions, related to map generation
 #~~~~~~~~~~~~~~~~~~~~~~~
 #-----------------------------
@@ -16,9 +29,16 @@ class StationLevel:
 		single level of in-game location
 		contains map of the level, also characters, items and other objects (i. e. stairs, doors) located here
 	"""
-	def __init__(self, level):
-		"create new level"
-		self.level_map = GameMap()
+	def __init__(self, level, seed = None, chunked = CHUNKED_LEVELS, size = None):
+		"""
+			create new level
+			levels, created with the same number and seed, are identical; random seed is chosen if it's omitted
+			if 'chunked' is True, the level gets huge ChunkedMap, that is generated part by part as the player explores it
+			'size' is a tuple (width, height) of the level's map; default size of the chosen map is used if it's omitted
+		"""
+		if seed is None:
+			seed = random.getrandbits(32)
+		self.seed = seed
 
 		#for now, it's just a number, that indicates how far you get in exploring the station
 		self.level = level
@@ -28,65 +48,239 @@ class StationLevel:
 		self.items = []
 		self.characters = []
 
-		self.place_enemies()
-		self.place_items()
-		self.place_stairs()
+		#characters, that take turns, and dormant ones, that stay in place until something wakes them up (see 'wake')
+		#dormant characters don't move, so they are kept in dict with their coordinates (x, y) as keys
+		self.active = []
+		self.dormant = {}
+		#order of turns of active characters and timed events of the level
+		self.scheduler = Scheduler()
+
+		#objects, that reside in chunks out of the active area of the map (only for chunked maps)
+		#dict with chunk coordinates as keys and dicts of lists like {'characters': [...], 'items': [...], 'environment': [...]} as values
+		self.suspended = {}
+
+		#separate random streams for the layout of the level and for everything, that is placed on it
+		map_rng = libtcod.random_new_from_seed(seed)
+
+		map_size = size or ()
+		if chunked:
+			self.level_map = ChunkedMap(seed, map_rng, *map_size)
+			#generate and fill the chunks around the starting room
+			(start_x, start_y) = self.get_player_start_pos()
+			self.update_active_area(start_x, start_y)
+		else:
+			self.level_map = GameMap(map_rng, *map_size)
+
+			spawn_rng = libtcod.random_new_from_seed(seed ^ SPAWN_SEED_SALT)
+			rooms = self.level_map.rooms
+			self.place_enemies(spawn_rng, rooms)
+			self.place_items(spawn_rng, rooms)
+			self.place_laser_rifle(spawn_rng, rooms)
+			self.place_stairs(spawn_rng, rooms)
+			self.place_back_stairs()
+			libtcod.random_delete(spawn_rng)
+
+		libtcod.random_delete(map_rng)
 
 	def get_player_start_pos(self):
 		"returns coordinates of the center of the starting room, where player will be placed"
 		return self.level_map.starting_room.center()
 
-	def place_enemies(self):
-		"fill the station level with enemies"
-		local_map = self.level_map.map_grid
-		for room in self.level_map.rooms:
+	def update_active_area(self, x, y):
+		"""
+			move the active area of the level's map, so it's centered around the point (x, y)
+			objects, that are left out of the active area, are suspended, objects of the chunks, that got into it, are restored,
+			and freshly generated chunks are filled with enemies and items
+			returns True if the active area has moved, so FOV maps should be recomputed
+		"""
+		level_map = self.level_map
+		new_chunks = level_map.focus(x, y)
+		if new_chunks is None:
+			return False
+
+		#suspend objects, that are out of the active area now
+		for kind in ('characters', 'items', 'environment'):
+			objects = getattr(self, kind)
+			for obj in [obj for obj in objects if not level_map.contains(obj.pos.x, obj.pos.y)]:
+				if kind == 'characters':
+					self.remove_character(obj)
+					obj.release_fov()
+				else:
+					objects.remove(obj)
+				chunk_objects = self.suspended.setdefault(level_map.chunk_key(obj.pos.x, obj.pos.y), {})
+				chunk_objects.setdefault(kind, []).append(obj)
+
+		#restore objects of the chunks, that are in the active area again
+		for key in level_map.active_chunks():
+			chunk_objects = self.suspended.pop(key, {})
+			for char in chunk_objects.pop('characters', []):
+				self.add_character(char)
+			for kind in chunk_objects:
+				getattr(self, kind).extend(chunk_objects[kind])
+
+		#free cells of the rooms are rebuilt with the active area, so the items take their cells again
+		for item in self.items:
+			level_map.set_item_spot(level_map.index(item.pos.x, item.pos.y), False)
+
+		#fill new chunks; each chunk has its own random stream, so chunks are the same no matter in which order they are visited
+		for chunk in new_chunks:
+			spawn_rng = libtcod.random_new_from_seed(chunk.seed ^ SPAWN_SEED_SALT)
+			self.place_enemies(spawn_rng, chunk.rooms)
+			self.place_items(spawn_rng, chunk.rooms)
+			if chunk.key == level_map.start_chunk:
+				self.place_laser_rifle(spawn_rng, chunk.rooms)
+				self.place_back_stairs()
+			if chunk.key == level_map.stairs_chunk:
+				self.place_stairs(spawn_rng, chunk.rooms)
+			libtcod.random_delete(spawn_rng)
+
+		#all FOV maps are bound to the old position of the active area
+		for char in self.characters:
+			char.init_fov()
+		return True
+
+	def release_fov(self):
+		"delete native FOV maps of the level and its characters, i. e. before the level is pickled or left"
+		for char in self.characters:
+			char.release_fov()
+		self.level_map.release_fov_map()
+
+	def add_character(self, char):
+		"put the character on the level; it's dormant, until something wakes it up"
+		self.characters.append(char)
+		char.awake = False
+		self.dormant[(char.pos.x, char.pos.y)] = char
+
+	def remove_character(self, char):
+		"take the character off the level, i. e. when it dies or gets out of the active area"
+		self.characters.remove(char)
+		if char.awake:
+			self.active.remove(char)
+			self.scheduler.cancel(char)
+			char.awake = False
+		else:
+			del self.dormant[(char.pos.x, char.pos.y)]
+
+	def add_item(self, item):
+		"put the item on the level at its position; no other item is placed on its cell, until it's taken away (see 'random_free_spot')"
+		self.items.append(item)
+		level_map = self.level_map
+		level_map.set_item_spot(level_map.index(item.pos.x, item.pos.y), False)
+
+	def remove_item(self, item):
+		"take the item off the level, i. e. when it's picked up"
+		self.items.remove(item)
+		if not [other for other in self.items if other.pos == item.pos]:
+			level_map = self.level_map
+			level_map.set_item_spot(level_map.index(item.pos.x, item.pos.y), True)
+
+	def wake(self, char):
+		"make the dormant character active, so it takes turns again; it's called when it sees the player, hears noise or gets damage"
+		if not char.awake and self.dormant.get((char.pos.x, char.pos.y)) is char:
+			del self.dormant[(char.pos.x, char.pos.y)]
+			char.awake = True
+			self.active.append(char)
+			self.scheduler.schedule(char, char.action_time())
+
+	def sleep(self, char):
+		"make the active character dormant"
+		if char.awake:
+			self.active.remove(char)
+			self.scheduler.cancel(char)
+			char.awake = False
+			char.sees_player = False
+			self.dormant[(char.pos.x, char.pos.y)] = char
+
+	def wake_on_cells(self, cells):
+		"wake up dormant characters, that stand on any of the cells (indexes in the map layers), i. e. on the ones, visible to the player"
+		level_map = self.level_map
+		(occupied, width) = (level_map.occupied, level_map.width)
+		for i in cells:
+			if occupied[i]:
+				char = self.dormant.get((i % width + level_map.x0, i / width + level_map.y0))
+				if char is not None:
+					self.wake(char)
+
+	def make_noise(self, x, y, radius = NOISE_RADIUS):
+		"wake up dormant characters, that are not farther than 'radius' cells from the point (x, y); they go to see, what has happened"
+		for char_x in range(x - radius, x + radius + 1):
+			for char_y in range(y - radius, y + radius + 1):
+				char = self.dormant.get((char_x, char_y))
+				if char is not None:
+					self.wake(char)
+					char.goal = (x, y)
+
+	def random_free_spot(self, rng, room, for_item = False):
+		"""
+			coordinates of a random free cell inside the room, or (None, None) if there is no room left
+			cells for characters are the ones, that are not occupied; cells for items are the ones without items (see 'add_item')
+		"""
+		cell = (room.item_spots if for_item else room.free).sample(rng)
+		if cell is None:
+			return (None, None)
+
+		level_map = self.level_map
+		return (cell % level_map.width + level_map.x0, cell / level_map.width + level_map.y0)
+
+	def place_enemies(self, rng, rooms):
+		"fill the rooms with enemies, using libtcod random generator 'rng'"
+		for room in rooms:
 			if room != self.level_map.starting_room:
-				num_enemies = libtcod.random_get_int(0, 0, MAX_ROOM_ENEMIES)
+				num_enemies = libtcod.random_get_int(rng, 0, MAX_ROOM_ENEMIES)
 				
 				for i in range(num_enemies):
-					#choose a random spot for an enemy
-					x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-					y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+					#choose a random spot for an enemy; placed enemy occupies it, so it's removed from the room's free cells
+					(x, y) = self.random_free_spot(rng, room)
+					if x is None:
+						break
 
 					#very poor mechanism of calculating chances
-					dice = libtcod.random_get_int(0, 0, 100)
-					if not local_map[x][y].is_blocked():
-						if dice < 80:
-							generate_enemy(self, x, y, 0)
-						else:
-							generate_enemy(self, x, y, 1)
-
-	def place_items(self):
-		"fill rooms with items"
-		local_map = self.level_map.map_grid
-		for room in self.level_map.rooms:
-			num_items = libtcod.random_get_int(0, 0, MAX_ROOM_ITEMS)
+					dice = libtcod.random_get_int(rng, 0, 100)
+					if dice < 80:
+						generate_enemy(self, x, y, 0)
+					else:
+						generate_enemy(self, x, y, 1)
+
+	def place_items(self, rng, rooms):
+		"fill rooms with items, using libtcod random generator 'rng'"
+		for room in rooms:
+			num_items = libtcod.random_get_int(rng, 0, MAX_ROOM_ITEMS)
 			
 			for i in range(num_items):
-				#choose random spot for an item
-				x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-				y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
-
-				if not local_map[x][y].is_blocked():
-					#roll the dice to know which item to generate
-					dice = libtcod.random_get_int(0, 0, 100)
-
-					if dice < 70:
-						add_item_to_lvl(self, x, y, 0)
-					elif dice < 70 + 10:
-						add_item_to_lvl(self, x, y, 1)
-					elif dice < 70 + 10 + 10:
-						add_item_to_lvl(self, x, y, 2)
-					else:
-						add_item_to_lvl(self, x, y, 3)
+				#choose random spot for an item; placed item takes it, so items are not piled up
+				(x, y) = self.random_free_spot(rng, room, True)
+				if x is None:
+					break
+
+				#roll the dice to know which item to generate
+				dice = libtcod.random_get_int(rng, 0, 100)
 
-		#place laser rifle in a random room; for now it's just for testing
-		gun_room = random.choice(self.level_map.rooms)
-		add_item_to_lvl(self, gun_room.center()[0], gun_room.center()[1], 6)
+				if dice < 70:
+					add_item_to_lvl(self, x, y, 0)
+				elif dice < 70 + 10:
+					add_item_to_lvl(self, x, y, 1)
+				elif dice < 70 + 10 + 10:
+					add_item_to_lvl(self, x, y, 2)
+				else:
+					add_item_to_lvl(self, x, y, 3)
+
+	def place_laser_rifle(self, rng, rooms):
+		"place laser rifle in a random room; for now it's just for testing"
+		gun_room = rooms[libtcod.random_get_int(rng, 0, len(rooms) - 1)]
+		(x, y) = gun_room.center()
+		if self.level_map.index(x, y) not in gun_room.item_spots: #the center is taken by another item
+			(x, y) = self.random_free_spot(rng, gun_room, True)
+		if x is not None:
+			add_item_to_lvl(self, x, y, 6)
 
-	def place_stairs(self):
-		"create stairs at the center of the last room"
-		generate_object(self)
+	def place_stairs(self, rng, rooms):
+		"create stairs at the center of one of the rooms"
+		generate_object(self, rng, rooms)
+
+	def place_back_stairs(self):
+		"create stairs to the previous level in the starting room; the first level of the game has nowhere to return"
+		if self.level < FIRST_LEVEL:
+			generate_back_stairs(self)
 
 	def closest_enemy(self, viewer, max_range):
 		"find closest enemy, up to a maximum range and in the viewer's FOV"
@@ -103,46 +297,120 @@ class StationLevel:
 
 		return closest_enemy
 
-class Tile:
+class TileType(object):
+	"""
+		immutable record with general properties of a tile type (explanation in 'globs.py')
+		there is only one record per type, shared by all tiles of this type; map layers keep just its id
 	"""
-		a tile of the map with its properties
+	__slots__ = ('id', 'title', 'walkable', 'transparent', 'vis_color', 'hid_color', 'hi_color')
+
+	def __init__(self, type_id, properties):
+		"create record with certain id from the dict of properties, like ones in 'TILE_TYPES'"
+		object.__setattr__(self, 'id', type_id)
+		for key in self.__slots__[1:]:
+			object.__setattr__(self, key, properties[key])
+
+	def __setattr__(self, name, value):
+		raise AttributeError('tile types are immutable')
+
+	def __reduce__(self):
+		"records are pickled by id, so unpickled tiles still share the same record"
+		return (get_tile_type, (self.id,))
+
+	def __repr__(self):
+		return 'TileType(%d, %r)' % (self.id, self.title)
+
+#records of all tile types, ordered by id (the index in 'TILE_PALETTE')
+TILE_TYPE_RECORDS = tuple(TileType(type_id, TILE_TYPES[key]) for (type_id, key) in enumerate(TILE_PALETTE))
+
+def get_tile_type(key):
+	"return the record of the tile type by its id or by its keyword in 'TILE_TYPES'"
+	if isinstance(key, basestring):
+		key = TILE_IDS[key]
+	return TILE_TYPE_RECORDS[key]
+
+class Tile(object):
+	"""
+		a lightweight view of a single cell of the map
+		the tile itself holds only its coordinates, all properties are read from and written to the layers of the map
 		it doesn't have any information about the objects placed on the top of itself
 	"""
-	def __init__(self, x, y, tile_type, occupied = False):
-		"create new tile with certain position and type"
+	__slots__ = ('level_map', 'x', 'y')
+
+	def __init__(self, level_map, x, y):
+		"create new view of the cell with certain position"
+		self.level_map = level_map #GameMap instance, that actually stores this tile
 		#coordinates of this tile according to the level's map
 		self.x = x
 		self.y = y
 
-		self.set_type(tile_type)
-		
-		self.occupied = occupied #indicates, if this tile is occupied by some object
-		self.explored = False #shows, if this tile has ever been in the FOV of the player
-		self.is_in_fov = False #shows, if this tile is currently in the FOV of the player
-		self.highlighted = False #highlighting matters in the 'calculate_color' function
+	def __reduce__(self):
+		"slotted objects can't be pickled by 'shelve' (protocol 0) without it"
+		return (Tile, (self.level_map, self.x, self.y))
+
+	def __eq__(self, other):
+		return isinstance(other, Tile) and self.level_map is other.level_map and self.x == other.x and self.y == other.y
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash((self.x, self.y))
+
+	def _index(self):
+		return self.level_map.index(self.x, self.y)
 
 	def set_type(self, tile_type):
 		"""
 			set general propeties of the tile, based on its type
-			types and basic explanations can be seen in TILE_TYPES 
+			types and basic explanations can be seen in TILE_TYPES
 		"""
-		its_type = TILE_TYPES[tile_type] #explanation in 'globs.py'
-		
-		self.title = its_type['title']
-		self.walkable = its_type['walkable']
-		self.transparent = its_type['transparent']
-		self.l_color = its_type['vis_color']
-		self.d_color = its_type['hid_color']
-		self.hi_color = its_type['hi_color']
+		self.level_map.set_type(self.x, self.y, tile_type)
+
+	@property
+	def type(self):
+		"shared TileType record of this tile"
+		return TILE_TYPE_RECORDS[self.level_map.tile_type[self._index()]]
+
+	#general properties of the tile, derived from its type (explanation in 'globs.py')
+	def _type_property(key):
+		def getter(self):
+			return getattr(self.type, key)
+		return property(getter)
+
+	title = _type_property('title')
+	l_color = _type_property('vis_color')
+	d_color = _type_property('hid_color')
+	hi_color = _type_property('hi_color')
+
+	#flags, that are stored in the map layers of the same name
+	def _layer_property(layer):
+		def getter(self):
+			return bool(getattr(self.level_map, layer)[self._index()])
+		def setter(self, value):
+			self.level_map.set_cell(layer, self._index(), value)
+		return property(getter, setter)
+
+	walkable = _layer_property('walkable')
+	transparent = _layer_property('transparent')
+	explored = _layer_property('explored') #shows, if this tile has ever been in the FOV of the player
+	is_in_fov = _layer_property('in_fov') #shows, if this tile is currently in the FOV of the player
+	highlighted = _layer_property('highlighted') #highlighting matters in the 'calculate_color' function
+
+	del _type_property, _layer_property
+
+	def _get_occupied(self):
+		return bool(self.level_map.occupied[self._index()])
+
+	def _set_occupied(self, value):
+		self.level_map.set_occupied(self._index(), value)
+
+	occupied = property(_get_occupied, _set_occupied) #indicates, if this tile is occupied by some object
+	del _get_occupied, _set_occupied
 
 	def is_blocked(self):
 		"return True if this block can be crossed by a character"
-		if not self.walkable:
-			return True
-		elif self.occupied:
-			return True
-		else:
-			return False
+		return self.level_map.is_blocked(self._index())
 
 	def highlight(self):
 		self.highlighted = True
@@ -152,58 +420,535 @@ class Tile:
 
 	def calculate_color(self):
 		"determine the color of the tile, based on its properties"
-		if not self.explored:
+		return self.level_map.calculate_color(self._index())
+
+class MapColumn:
+	"single column of the map, makes possible to address tiles as 'map_grid[x][y]'"
+	def __init__(self, level_map, x):
+		self.level_map = level_map
+		self.x = x
+
+	def __getitem__(self, y):
+		if not self.level_map.y0 <= y < self.level_map.y0 + self.level_map.height:
+			raise IndexError('tile is out of the map')
+		return Tile(self.level_map, self.x, y)
+
+	def __len__(self):
+		return self.level_map.height
+
+class LayeredMap:
+	"""
+		base class for maps, that store their tiles as struct of arrays:
+		every property of the map is a separate packed layer: bytearray with one byte per cell,
+		or Bitset with one bit per cell for the flags of exploration and visibility
+		layers may cover only a part of the map - the rectangle with top-left corner (x0, y0) and size (width, height);
+		cell (x, y) has index '(y - y0) * width + (x - x0)' in every layer
+	"""
+	#coordinates of the top-left cell, covered by the layers
+	x0 = 0
+	y0 = 0
+	#layers, that describe the terrain; shared FOV map and cached fields of view depend on them
+	TERRAIN_LAYERS = ('tile_type', 'walkable', 'transparent')
+	LAYERS = TERRAIN_LAYERS + ('occupied', 'explored', 'in_fov', 'highlighted')
+
+	journal = None #ChangeJournal instance, every change of the cells should be recorded there
+	fov_map = None #native libtcod map, shared by all characters of the level (see 'get_fov_map')
+	fov_map_revision = 0 #revision of the journal, the shared FOV map is up to date with
+	fov_cache = None #FOVCache instance with fields of view, computed on this map (see 'visible_cells')
+	chase_map = None #native libtcod Dijkstra map with distances to the chased target (see 'chase_step')
+	chase_key = None #tuple (target_x, target_y, terrain revision), the chase map has been computed for
+	chase_distances = None #numpy array with distances of the chase map, copied from it for the batch AI stage (see 'get_chase_distances')
+	chase_distances_key = None #'chase_key' of the chase map, the distances have been copied from
+	room_routes = None #routes between the rooms, that have been found already (see 'room_route')
+	tunnels = () #rectangles (x1, y1, x2, y2) of the carved tunnels, used with the rooms to build connectivity index
+	INDEX_BUCKET = 16 #size of the squares of coarse grid, where touching rooms and tunnels are searched (see 'build_room_index')
+
+	def init_layers(self, width, height):
+		"create layers of certain size, filled with impassable tiles"
+		self.release_fov_map()
+		self.fov_cache = None
+		if self.journal is None:
+			self.journal = ChangeJournal()
+		self.journal.invalidate(LayeredMap.LAYERS)
+		self.width = width
+		self.height = height
+
+		size = width * height
+		wall = get_tile_type('wall')
+		self.tile_type = bytearray([wall.id]) * size #id of the TileType record
+		self.walkable = bytearray([wall.walkable]) * size
+		self.transparent = bytearray([wall.transparent]) * size
+		self.occupied = bytearray(size) #indicates, if the cell is occupied by some object
+		self.explored = Bitset(size) #shows, if the cell has ever been in the FOV of the player
+		self.in_fov = Bitset(size) #shows, if the cell is currently in the FOV of the player
+		self.highlighted = bytearray(size)
+
+	def __getstate__(self):
+		"native maps can't be pickled, they are recreated on demand after unpickling; cached fields of view are dropped as well"
+		state = self.__dict__.copy()
+		for name in ('fov_map', 'fov_cache', 'chase_map', 'chase_key', 'chase_distances', 'chase_distances_key'):
+			state.pop(name, None)
+		return state
+
+	@property
+	def map_grid(self):
+		"the map itself, so the tiles can be accessed as 'map_grid[x][y]'"
+		return self
+
+	def __getitem__(self, x):
+		if not self.x0 <= x < self.x0 + self.width:
+			raise IndexError('tile is out of the map')
+		return MapColumn(self, x)
+
+	def __len__(self):
+		return self.width
+
+	def contains(self, x, y):
+		"check, whether the cell (x, y) is covered by the layers"
+		return self.x0 <= x < self.x0 + self.width and self.y0 <= y < self.y0 + self.height
+
+	def index(self, x, y):
+		"index of the cell (x, y) in map layers"
+		return (y - self.y0) * self.width + x - self.x0
+
+	def focus(self, x, y):
+		"""
+			move the area, covered by the layers, so it contains the point (x, y)
+			returns the list of chunks, that have just got into this area for the first time, or None if the area hasn't moved
+			maps, that cover all their cells (like GameMap), never move
+		"""
+		return None
+
+	def set_type(self, x, y, tile_type):
+		"change the type of the cell, updating all layers, that depend on it"
+		its_type = get_tile_type(tile_type) #explanation in 'globs.py'
+		i = self.index(x, y)
+
+		self.tile_type[i] = its_type.id
+		self.walkable[i] = its_type.walkable
+		self.transparent[i] = its_type.transparent
+		self.journal.record('tile_type', i)
+
+	def set_cell(self, layer, i, value):
+		"set the flag of the cell with index 'i' in the layer with certain name and record the change"
+		getattr(self, layer)[i] = 1 if value else 0
+		self.journal.record(layer, i)
+
+	def get_fov_map(self):
+		"""
+			libtcod map with transparency and walkability of the cells, shared by all characters of the level
+			it covers the same area as map layers and is created on the first use; walkability reflects only the terrain
+		"""
+		if self.fov_map is None:
+			self.fov_map = libtcod.map_new(self.width, self.height)
+			self.fov_map_revision = -1 #the map is empty, so it's older than any revision
+		if self.fov_map_revision != self.journal.revision:
+			self.fov_map_revision = self.update_fov_map(self.fov_map, self.fov_map_revision)
+		return self.fov_map
+
+	def update_fov_map(self, fov_map, revision):
+		"""
+			bring libtcod map, that reflected the layers at certain revision of the journal, up to date
+			only changed cells are updated, unless the journal has forgotten some of the changes; returns current revision
+			changes of other layers (i. e. occupied cells, FOV of the player) don't matter, so the journal isn't asked, if there are only them
+		"""
+		if self.journal.layer_revision(*LayeredMap.TERRAIN_LAYERS) <= revision:
+			return self.journal.revision
+		changes = self.journal.changes_since(revision)
+		(transparent, walkable, width) = (self.transparent, self.walkable, self.width)
+		if changes is None:
+			#cleared map is opaque and impassable, so only cells, that differ from walls, are set
+			libtcod.map_clear(fov_map)
+			for i in xrange(width * self.height):
+				if transparent[i] or walkable[i]:
+					libtcod.map_set_properties(fov_map, i % width, i / width, transparent[i], walkable[i])
+		else:
+			for i in set(i for (layer, i) in changes if layer in LayeredMap.TERRAIN_LAYERS):
+				libtcod.map_set_properties(fov_map, i % width, i / width, transparent[i], walkable[i])
+		return self.journal.revision
+
+	def visible_cells(self, fov_map, x, y, radius = TORCH_RADIUS, light_walls = FOV_LIGHT_WALLS, algo = FOV_ALGO, engine = FOV_ENGINE):
+		"""
+			return frozenset of indexes of the cells, that can be seen from the point (x, y)
+			field of view is computed by the chosen engine (explanation in 'globs.py'), unless it's found in the cache;
+			libtcod computes it on 'fov_map' (the shared one or a private copy of it), so 'fov_map' also holds the result
+		"""
+		if self.fov_cache is None:
+			self.fov_cache = FOVCache()
+
+		#fields of view become outdated, as soon as the terrain changes
+		key = (x, y, radius, light_walls, algo if engine == 'libtcod' else engine, self.journal.layer_revision(*LayeredMap.TERRAIN_LAYERS))
+		visible = self.fov_cache.get(key)
+		if visible is None and engine == 'shadowcasting':
+			(visibility, cells) = shadowcast(self.transparent, self.width, self.height, x - self.x0, y - self.y0, radius, light_walls)
+			visible = frozenset(cells)
+			self.fov_cache.put(key, visible)
+
+		elif visible is None:
+			(x, y) = (x - self.x0, y - self.y0)
+			libtcod.map_compute_fov(fov_map, x, y, radius, light_walls, algo)
+
+			#only cells within the radius can be visible, the whole map should be checked only for unlimited radius
+			if radius > 0:
+				(x1, y1) = (max(x - radius, 0), max(y - radius, 0))
+				(x2, y2) = (min(x + radius, self.width - 1), min(y + radius, self.height - 1))
+			else:
+				(x1, y1, x2, y2) = (0, 0, self.width - 1, self.height - 1)
+
+			width = self.width
+			visible = frozenset(cell_y * width + cell_x for cell_y in range(y1, y2 + 1) for cell_x in range(x1, x2 + 1)
+								if libtcod.map_is_in_fov(fov_map, cell_x, cell_y))
+			self.fov_cache.put(key, visible)
+		return visible
+
+	def get_chase_map(self, target_x, target_y, planner = None):
+		"""
+			Dijkstra map with distances from every cell to the point (target_x, target_y), shared by all characters, that chase it
+			it's computed on the shared FOV map only when the target moves or the terrain changes, i. e. once per player's move
+			if 'planner' (AI.Planner) has no time left in this frame, the map, computed for the old position of the target, is returned,
+			and computation is postponed; the map is always recomputed after the terrain changes
+		"""
+		fov_map = self.get_fov_map()
+		if self.chase_map is None:
+			self.chase_map = libtcod.dijkstra_new(fov_map, 1.41)
+			self.chase_key = None
+
+		key = (target_x, target_y, self.journal.layer_revision(*LayeredMap.TERRAIN_LAYERS))
+		if self.chase_key is not None and self.chase_key[2] == key[2] and planner is not None and not planner.allows():
+			if self.chase_key != key:
+				planner.defer(('chase', id(self)), self.get_chase_map, target_x, target_y)
+		elif self.chase_key != key:
+			libtcod.dijkstra_compute(self.chase_map, target_x - self.x0, target_y - self.y0)
+			self.chase_key = key
+		return self.chase_map
+
+	def get_chase_distances(self, cells, target_x, target_y, planner = None):
+		"""
+			distances from the cells with indexes 'cells' (numpy array) to the point (target_x, target_y) on the chase map (see 'get_chase_map')
+			as numpy array of the same shape; unreachable cells are infinitely far; numpy is required
+			native map is asked for the distance of every cell only once after it's computed, i. e. once per player's move,
+			and only for the cells, that are needed, so the crowd of chasers doesn't ask for the same cells again and again
+		"""
+		chase_map = self.get_chase_map(target_x, target_y, planner)
+		if self.chase_distances_key != self.chase_key:
+			self.chase_distances = numpy.empty(self.width * self.height)
+			self.chase_distances.fill(numpy.nan) #not copied yet
+			self.chase_distances_key = self.chase_key
+
+		distances = self.chase_distances
+		width = self.width
+		get_distance = libtcod.dijkstra_get_distance
+		for i in numpy.unique(cells[numpy.isnan(distances[cells])]).tolist():
+			distance = get_distance(chase_map, i % width, i / width)
+			distances[i] = distance if distance >= 0 else numpy.inf
+		return distances[cells]
+
+	def chase_step(self, x, y, target_x, target_y, planner = None):
+		"""
+			direction (dx, dy) of the step from the point (x, y) down the chase map towards the target
+			returns None if the target can't be reached or all cells closer to it are blocked
+		"""
+		chase_map = self.get_chase_map(target_x, target_y, planner)
+		(x, y) = (x - self.x0, y - self.y0)
+		best_distance = libtcod.dijkstra_get_distance(chase_map, x, y)
+		if best_distance < 0: #unreachable
+			return None
+
+		step = None
+		for (dx, dy) in ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+			(cell_x, cell_y) = (x + dx, y + dy)
+			if 0 <= cell_x < self.width and 0 <= cell_y < self.height and not self.is_blocked(cell_y * self.width + cell_x):
+				distance = libtcod.dijkstra_get_distance(chase_map, cell_x, cell_y)
+				if 0 <= distance < best_distance:
+					(step, best_distance) = ((dx, dy), distance)
+		return step
+
+	def release_fov_map(self):
+		"delete the shared FOV map and the chase map, that is built on it; they will be created again, if needed"
+		if self.chase_map is not None:
+			libtcod.dijkstra_delete(self.chase_map)
+			self.chase_map = None
+			self.chase_distances = self.chase_distances_key = None
+		if self.fov_map is not None:
+			libtcod.map_delete(self.fov_map)
+			self.fov_map = None
+
+	def is_blocked(self, i):
+		"return True if the cell with index 'i' can't be crossed by a character"
+		return not self.walkable[i] or self.occupied[i]
+
+	def set_occupied(self, i, value):
+		"mark the cell with index 'i' as occupied (or free) and keep free cells of its room up to date"
+		self.set_cell('occupied', i, value)
+
+		number = self.room_id[i]
+		if number:
+			room = self.rooms[number - 1]
+			if value:
+				room.free.remove(i)
+			elif self.walkable[i] and room.inside(i % self.width + self.x0, i / self.width + self.y0):
+				room.free.add(i)
+
+	def set_item_spot(self, i, value):
+		"mark the cell with index 'i' as the one, where an item can be placed (or not), in the free cells of its room"
+		number = self.room_id[i]
+		if number:
+			room = self.rooms[number - 1]
+			if not value:
+				room.item_spots.remove(i)
+			elif self.walkable[i] and room.inside(i % self.width + self.x0, i / self.width + self.y0):
+				room.item_spots.add(i)
+
+	def calculate_color(self, i):
+		"determine the color of the cell with index 'i', based on its properties"
+		if not self.explored[i]:
 			return libtcod.black
-			
-		if self.is_in_fov:
-			if self.highlighted:
-				return self.hi_color
+
+		its_type = TILE_TYPE_RECORDS[self.tile_type[i]]
+		if self.in_fov[i]:
+			if self.highlighted[i]:
+				return its_type.hi_color
 			else:
-				return self.l_color
+				return its_type.vis_color
 		else:
-			return self.d_color
+			return its_type.hid_color
+
+	def reveal(self):
+		"mark the whole map as explored"
+		self.explored.set_all()
+		self.journal.invalidate(['explored'])
+
+	def fill_rect(self, layer, rect, value):
+		"set every cell of the rectangle (x1, y1, x2, y2) in the layer of type 'array' to the value; only the part, covered by the layers, is set"
+		(x1, y1, x2, y2) = rect
+		(x1, x2) = (max(x1, self.x0), min(x2, self.x0 + self.width - 1))
+		(y1, y2) = (max(y1, self.y0), min(y2, self.y0 + self.height - 1))
+		if x1 > x2 or y1 > y2:
+			return
+		if x1 == x2:
+			layer[self.index(x1, y1):self.index(x1, y2) + 1:self.width] = array(layer.typecode, [value]) * (y2 - y1 + 1)
+			return
+		for y in range(y1, y2 + 1):
+			start = self.index(x1, y)
+			layer[start:start + x2 - x1 + 1] = array(layer.typecode, [value]) * (x2 - x1 + 1)
+
+	def build_room_index(self):
+		"""
+			build connectivity index of the map from its rooms and tunnels (see 'GameMap.dig'), without looking at single cells:
+				'room_id' layer - index of the room in 'rooms' plus one for every cell inside a room, 0 for other cells
+				'component' layer - number of the connected area for every passable cell (starting from 1), 0 for walls
+				'room_graph' - for every room, a dict {index of neighbouring room: (door, neighbour's door)}, where doors are
+					indexes of the cells, through which the rooms are connected (usually the ends of the tunnel between them)
+			rooms are neighbours, if they touch each other or the same tunnel (chain of tunnels, that touch each other)
+			rooms and tunnels are rectangles, so touching ones are found by comparing the rectangles, that share a bucket of coarse grid
+		"""
+		size = self.width * self.height
+		rooms = [(room.x1, room.y1, room.x2, room.y2) for room in self.rooms]
+		number_of_rooms = len(rooms)
+		bucket = LayeredMap.INDEX_BUCKET
+
+		self.room_id = array('H', [0]) * size
+		for (number, rect) in enumerate(rooms):
+			self.fill_rect(self.room_id, rect, number + 1)
 
-class GameMap:
+		#tunnels are cut into pieces by the rooms, they cross, as a tunnel leads only to the rooms, that its cells outside of rooms touch
+		room_buckets = {}
+		for (number, rect) in enumerate(rooms):
+			for key in grid_squares(rect, bucket, 0):
+				room_buckets.setdefault(key, []).append(number)
+		parts = rooms[:] #rectangles (x1, y1, x2, y2) with inclusive corners: rooms go first, then pieces of tunnels
+		for tunnel in self.tunnels:
+			crossed = set()
+			for key in grid_squares(tunnel, bucket, 0):
+				crossed.update(room_buckets.get(key, ()))
+			parts.extend(cut_tunnel(tunnel, [rooms[number] for number in crossed]))
+
+		#pairs of parts (by their indexes in 'parts'), that touch or cross each other
+		buckets = {}
+		for (number, rect) in enumerate(parts):
+			for key in grid_squares(rect, bucket, 1):
+				buckets.setdefault(key, []).append(number)
+		touching = set()
+		for members in buckets.itervalues():
+			for (position, first) in enumerate(members):
+				(x1, y1, x2, y2) = parts[first]
+				for second in members[position + 1:]:
+					(other_x1, other_y1, other_x2, other_y2) = parts[second]
+					if x1 <= other_x2 + 1 and other_x1 <= x2 + 1 and y1 <= other_y2 + 1 and other_y1 <= y2 + 1:
+						touching.add((first, second))
+		touching = sorted(touching) #the index shouldn't depend on the order of the buckets
+
+		#join touching parts into connected areas, and touching tunnels into single tunnels (union-find)
+		areas = range(len(parts))
+		tunnels = range(len(parts))
+		for (first, second) in touching:
+			areas[find_root(areas, first)] = find_root(areas, second)
+			if first >= number_of_rooms:
+				tunnels[find_root(tunnels, first)] = find_root(tunnels, second)
+
+		self.component = array('H', [0]) * size
+		numbers = {}
+		for (number, rect) in enumerate(parts):
+			self.fill_rect(self.component, rect, numbers.setdefault(find_root(areas, number), len(numbers) + 1))
+
+		self.room_graph = [{} for room in self.rooms]
+		self.room_routes = None
+		doors = {} #root of the tunnel: {room index: cell of the tunnel next to the room}
+		for (first, second) in touching:
+			if second < number_of_rooms: #rooms, that touch each other directly
+				((x, y), (other_x, other_y)) = closest_cells(parts[first], parts[second])
+				if self.contains(x, y) and self.contains(other_x, other_y):
+					(i, j) = (self.index(x, y), self.index(other_x, other_y))
+					self.room_graph[first][second] = (i, j)
+					self.room_graph[second][first] = (j, i)
+			elif first < number_of_rooms: #tunnel, that touches the room
+				(door, inner) = closest_cells(parts[second], parts[first])
+				if self.contains(*door):
+					doors.setdefault(find_root(tunnels, second), {}).setdefault(first, self.index(*door))
+
+		for tunnel_doors in doors.itervalues():
+			for (room, door) in tunnel_doors.items():
+				for (other, other_door) in tunnel_doors.items():
+					if other != room:
+						self.room_graph[room].setdefault(other, (door, other_door))
+
+	def build_free_cells(self):
+		"""
+			fill every room's sets of free cells inside the room (excluding its border): 'free' - passable and not occupied cells,
+			'item_spots' - passable cells, where items can be placed; cells with items are removed from it by the level
+		"""
+		for room in self.rooms:
+			room.free = FreeCells()
+			room.item_spots = FreeCells()
+			for y in range(max(room.y1 + 1, self.y0), min(room.y2, self.y0 + self.height)):
+				for x in range(max(room.x1 + 1, self.x0), min(room.x2, self.x0 + self.width)):
+					i = self.index(x, y)
+					if self.walkable[i]:
+						room.item_spots.add(i)
+						if not self.occupied[i]:
+							room.free.add(i)
+
+	def room_at(self, x, y):
+		"index of the room (in 'rooms'), that contains the cell (x, y), or None if the cell is outside of any room"
+		number = self.room_id[self.index(x, y)]
+		return number - 1 if number else None
+
+	def connected(self, x1, y1, x2, y2):
+		"check, whether one cell can be reached from another (objects on the way are not taken into account)"
+		component = self.component[self.index(x1, y1)]
+		return component != 0 and component == self.component[self.index(x2, y2)]
+
+	def neighbour_rooms(self, room):
+		"indexes of the rooms, that are connected with the room (its index in 'rooms') directly or by single tunnel"
+		return self.room_graph[room].keys()
+
+	def room_route(self, start, goal):
+		"""
+			the shortest sequence of rooms from the room 'start' to the room 'goal' (both included) over the room graph,
+			or None if there is no route; distance between neighbouring rooms is the distance between their centers
+			found routes are kept until the room graph is built again
+		"""
+		if self.room_routes is None:
+			self.room_routes = {}
+		if (start, goal) in self.room_routes:
+			return self.room_routes[(start, goal)]
+
+		#Dijkstra's algorithm: graph is small, so it's much cheaper, than any search over the cells
+		previous = {start: None}
+		distances = {start: 0}
+		queue = [(0, start)]
+		while queue:
+			(distance, room) = heapq.heappop(queue)
+			if room == goal:
+				break
+			if distance > distances[room]:
+				continue
+			(x, y) = self.rooms[room].center()
+			for other in self.neighbour_rooms(room):
+				(other_x, other_y) = self.rooms[other].center()
+				new_distance = distance + sqrt((other_x - x) ** 2 + (other_y - y) ** 2)
+				if new_distance < distances.get(other, new_distance + 1):
+					distances[other] = new_distance
+					previous[other] = room
+					heapq.heappush(queue, (new_distance, other))
+
+		route = None
+		if goal in previous:
+			route = [goal]
+			while route[-1] != start:
+				route.append(previous[route[-1]])
+			route.reverse()
+		self.room_routes[(start, goal)] = route
+		return route
+
+	def waypoint(self, start_room, x, y):
+		"""
+			the point, a character should go to from the room 'start_room' to get to the point (x, y) (see 'Character.move_astar'):
+			the point itself, if it's in the same or the neighbouring room (or outside of any room),
+			otherwise the door of the next room on the route, that leads to the room after it
+		"""
+		goal_room = self.room_at(x, y)
+		if start_room is None or goal_room is None or start_room == goal_room:
+			return (x, y)
+
+		route = self.room_route(start_room, goal_room)
+		if route is None or len(route) < 3:
+			return (x, y)
+
+		door = self.room_graph[route[1]][route[2]][0]
+		return (door % self.width + self.x0, door / self.width + self.y0)
+
+class GameMap(LayeredMap):
 	"""
-		map of the in-game location
-		simply speaking, a two-dimensional list of tiles
+		map of the in-game location, generated with BSP
+		simply speaking, a two-dimensional array of tiles (see LayeredMap)
 		also contains rooms and corridors
 	"""
-	def __init__(self):
-		"create map using BSP"
+	def __init__(self, rng = 0, width = MAP_WIDTH, height = MAP_HEIGHT):
+		"create map using BSP; all random decisions are taken from libtcod random generator 'rng'"
 		#fill map with impassable tiles
-		self.map_grid = [ [Tile(x, y, 'wall') for y in range(MAP_HEIGHT)] for x in range(MAP_WIDTH) ]
+		self.init_layers(width, height)
 
 		self.rooms = [] #rooms on current map, presented by Rectangle instances
+		self.tunnels = [] #tunnels on current map, presented by tuples (x1, y1, x2, y2), see 'dig'
 		
+		#random generator and carving plan are needed only while the map is being generated, as they are used by BSP callback
+		self.rng = rng
+		self.carve_plan = []
+
 		#new root node
-		bsp = libtcod.bsp_new_with_size(0, 0, MAP_WIDTH, MAP_HEIGHT)
+		bsp = libtcod.bsp_new_with_size(0, 0, width, height)
 
 		#split into nodes
-		libtcod.bsp_split_recursive(bsp, 0, DEPTH, ROOM_MIN_SIZE + 1, ROOM_MIN_SIZE + 1, 1.5, 1.5)
+		libtcod.bsp_split_recursive(bsp, rng, DEPTH, ROOM_MIN_SIZE + 1, ROOM_MIN_SIZE + 1, 1.5, 1.5)
 
-		#traverse the nodes and create rooms
+		#traverse the nodes and plan rooms and tunnels, then carve them all in one pass
 		libtcod.bsp_traverse_inverted_level_order(bsp, self.traverse_node)
+		libtcod.bsp_delete(bsp)
+		self.carve(self.carve_plan)
+		self.build_room_index()
+		self.build_free_cells()
 
 		self.choose_starting_room()
+		del self.rng, self.carve_plan
 
 	def traverse_node(self, node, dat):
-		"callback-function for BSP map generating"
+		"callback-function for BSP map generating; doesn't change the map, only adds operations to the carving plan"
 		if libtcod.bsp_is_leaf(node): #if node is a leaf, create room
 			min_x = node.x + 1
 			max_x = node.x + node.w - 1
 			min_y = node.y + 1
 			max_y = node.y + node.h - 1
 			
-			if max_x == MAP_WIDTH - 1: max_x -= 1
-			if max_y == MAP_HEIGHT - 1: max_y -= 1
+			if max_x == self.width - 1: max_x -= 1
+			if max_y == self.height - 1: max_y -= 1
 
 			#randomize room size if FULL_ROOMS is disabled
 			if FULL_ROOMS == False:
-				min_x = libtcod.random_get_int(0, min_x, max_x - ROOM_MIN_SIZE + 1)
-				min_y = libtcod.random_get_int(0, min_y, max_y - ROOM_MIN_SIZE + 1)
-				max_x = libtcod.random_get_int(0, min_x + ROOM_MIN_SIZE - 2, max_x)
-				max_y = libtcod.random_get_int(0, min_y + ROOM_MIN_SIZE - 2, max_y)
+				min_x = libtcod.random_get_int(self.rng, min_x, max_x - ROOM_MIN_SIZE + 1)
+				min_y = libtcod.random_get_int(self.rng, min_y, max_y - ROOM_MIN_SIZE + 1)
+				max_x = libtcod.random_get_int(self.rng, min_x + ROOM_MIN_SIZE - 2, max_x)
+				max_y = libtcod.random_get_int(self.rng, min_y + ROOM_MIN_SIZE - 2, max_y)
 
 			node.x = min_x
 			node.y = min_y
@@ -211,7 +956,7 @@ class GameMap:
 			node.h = max_y - min_y + 1
 
 			new_room = Rectangle(node.x, node.y, node.w - 1, node.h - 1)
-			self.create_room(new_room)
+			self.carve_plan.append(('create_room', (new_room,)))
 
 		else: #if the node is not a leaf, connect its left and right children
 			
@@ -225,87 +970,355 @@ class GameMap:
 			if node.horizontal: #if node is splitted horizontally
 				#if left and right nodes intersect
 				if left.x + left.w - 1 < right.x or right.x + right.w - 1 < left.x:
-					x1 = libtcod.random_get_int(0, left.x , left.x + left.w - 1)
-					x2 = libtcod.random_get_int(0, right.x , right.x + right.w - 1)
-					y = libtcod.random_get_int(0, left.y + left.h, right.y)
-					self.create_vert_line_up(x1, y - 1)
-					self.create_hor_line(y, x1, x2)
-					self.create_vert_line_down(x2, y + 1)
+					x1 = libtcod.random_get_int(self.rng, left.x , left.x + left.w - 1)
+					x2 = libtcod.random_get_int(self.rng, right.x , right.x + right.w - 1)
+					y = libtcod.random_get_int(self.rng, left.y + left.h, right.y)
+					self.carve_plan.append(('create_vert_line_up', (x1, y - 1)))
+					self.carve_plan.append(('create_hor_line', (y, x1, x2)))
+					self.carve_plan.append(('create_vert_line_down', (x2, y + 1)))
 
 				#if left and right nodes do not intersect
 				else:
 					min_x = max(left.x + 1, right.x + 1)
 					max_x = min(left.x + left.w - 1, right.x + right.w - 1)
-					x = libtcod.random_get_int(0, min_x, max_x)
-					self.create_vert_line_down(x, right.y)
-					self.create_vert_line_up(x, right.y - 1)
+					x = libtcod.random_get_int(self.rng, min_x, max_x)
+					self.carve_plan.append(('create_vert_line_down', (x, right.y)))
+					self.carve_plan.append(('create_vert_line_up', (x, right.y - 1)))
 			else: #if node is splitted vertically
 				#if left and right nodes intersect
 				if left.y + left.h - 1 < right.y or right.y + right.h - 1 < left.y:
-					y1 = libtcod.random_get_int(0, left.y + 1, left.y + left.h - 1)
-					y2 = libtcod.random_get_int(0, right.y + 1, right.y + right.h - 1)
-					x = libtcod.random_get_int(0, left.x + left.w + 1, right.x)
-					self.create_hor_line_left(x - 1, y1)
-					self.create_vert_line(x, y1, y2)
-					self.create_hor_line_right(x + 1, y2)
+					y1 = libtcod.random_get_int(self.rng, left.y + 1, left.y + left.h - 1)
+					y2 = libtcod.random_get_int(self.rng, right.y + 1, right.y + right.h - 1)
+					x = libtcod.random_get_int(self.rng, left.x + left.w + 1, right.x)
+					self.carve_plan.append(('create_hor_line_left', (x - 1, y1)))
+					self.carve_plan.append(('create_vert_line', (x, y1, y2)))
+					self.carve_plan.append(('create_hor_line_right', (x + 1, y2)))
 
 				#if left and right nodes do not intersect
 				else:
 					min_y = max(left.y + 1, right.y + 1)
 					max_y = min(left.y + left.h - 1, right.y + right.h - 1)
-					y = libtcod.random_get_int(0, min_y, max_y)
-					self.create_hor_line_left(right.x - 1, y)
-					self.create_hor_line_right(right.x, y)
+					y = libtcod.random_get_int(self.rng, min_y, max_y)
+					self.carve_plan.append(('create_hor_line_left', (right.x - 1, y)))
+					self.carve_plan.append(('create_hor_line_right', (right.x, y)))
 		return True
 	
-	def create_room(self, room):
+	def fill(self, start, stop, step, tile_type = 'floor'):
+		"set the type of every cell with index in range(start, stop, step) at once"
+		count = len(xrange(start, stop, step))
+		if count <= 0:
+			return
+
+		self.journal.invalidate(LayeredMap.TERRAIN_LAYERS) #too many cells are changed to record them one by one
+		its_type = get_tile_type(tile_type) #explanation in 'globs.py'
+		self.tile_type[start:stop:step] = bytearray([its_type.id]) * count
+		self.walkable[start:stop:step] = bytearray([its_type.walkable]) * count
+		self.transparent[start:stop:step] = bytearray([its_type.transparent]) * count
+
+	def dig(self, start, stop, step, tile_type = 'floor'):
+		"carve the tunnel - row (if 'step' is 1) or column of the cells with index in range(start, stop, step), and remember its rectangle"
+		count = len(xrange(start, stop, step))
+		if count <= 0:
+			return
+		self.fill(start, stop, step, tile_type)
+		last = start + (count - 1) * step
+		self.tunnels.append((start % self.width, start / self.width, last % self.width, last / self.width))
+
+	def carve(self, plan):
+		"""
+			replay carving plan - list of tuples (method name, arguments), like ('create_hor_line', (y, x1, x2))
+			operations are applied in order, as tunnels stop at the cells, carved by the previous ones
+		"""
+		for (operation, args) in plan:
+			getattr(self, operation)(*args)
+
+	def create_room(self, room, tile_type = 'floor'):
 		"carve rectangle room"
-		#go through the tiles in the rectangle and make them passable by changing their type
-		for x in range(room.x1, room.x2 + 1):
-			for y in range(room.y1, room.y2 + 1):
-				self.map_grid[x][y].set_type('floor')
+		#change the type of the whole row of the rectangle at once
+		for y in range(room.y1, room.y2 + 1):
+			row = y * self.width
+			self.fill(row + room.x1, row + room.x2 + 1, 1, tile_type)
 
 		self.rooms.append(room)
 
-	def create_vert_line(self, x, y1, y2):
+	def create_vert_line(self, x, y1, y2, tile_type = 'floor'):
 		"carve vertical tunnel"
-		for y in range(min(y1, y2), max(y1, y2) + 1):
-			self.map_grid[x][y].set_type('floor')
+		self.dig(min(y1, y2) * self.width + x, (max(y1, y2) + 1) * self.width + x, self.width, tile_type)
 	 
-	def create_vert_line_up(self, x, y):
-		"carve vertical tunnel from point and up"
-		while y > 0 and not self.map_grid[x][y].walkable:
-			self.map_grid[x][y].set_type('floor')
-			y -= 1
+	def create_vert_line_up(self, x, y, tile_type = 'floor'):
+		"carve vertical tunnel from point and up, until it reaches passable tile or the top row"
+		if y <= 0:
+			return
+		#find the closest passable tile in the column above the point
+		column = self.walkable[x::self.width]
+		stop = column.rfind(b'\x01', 1, y + 1) + 1
+		self.dig(max(stop, 1) * self.width + x, (y + 1) * self.width + x, self.width, tile_type)
 	 
-	def create_vert_line_down(self, x, y):
-		"carve vertical tunnel from point and down"
-		while y < MAP_HEIGHT and not self.map_grid[x][y].walkable:
-			self.map_grid[x][y].set_type('floor')
-			y += 1
+	def create_vert_line_down(self, x, y, tile_type = 'floor'):
+		"carve vertical tunnel from point and down, until it reaches passable tile or the bottom of the map"
+		#find the closest passable tile in the column below the point
+		column = self.walkable[x::self.width]
+		stop = column.find(b'\x01', y)
+		if stop == -1:
+			stop = self.height
+		self.dig(y * self.width + x, stop * self.width + x, self.width, tile_type)
 	 
-	def create_hor_line(self, y, x1, x2):
+	def create_hor_line(self, y, x1, x2, tile_type = 'floor'):
 		"carve horizontal tunnel"
-		for x in range(min(x1, x2), max(x1, x2) + 1):
-			self.map_grid[x][y].set_type('floor')
+		row = y * self.width
+		self.dig(row + min(x1, x2), row + max(x1, x2) + 1, 1, tile_type)
 	 
-	def create_hor_line_left(self, x, y):
-		"carve horizontal tunnel from point and left"
-		while x > 0 and not self.map_grid[x][y].walkable:
-			self.map_grid[x][y].set_type('floor')
-			x -= 1
+	def create_hor_line_left(self, x, y, tile_type = 'floor'):
+		"carve horizontal tunnel from point and left, until it reaches passable tile or the leftmost column"
+		if x <= 0:
+			return
+		#find the closest passable tile in the row to the left of the point
+		row = y * self.width
+		stop = self.walkable.rfind(b'\x01', row + 1, row + x + 1) + 1
+		self.dig(max(stop, row + 1), row + x + 1, 1, tile_type)
 	 
-	def create_hor_line_right(self, x, y):
-		"carve horizontal tunnel from point and right"
-		while x < MAP_WIDTH and not self.map_grid[x][y].walkable:
-			self.map_grid[x][y].set_type('floor')
-			x += 1
+	def create_hor_line_right(self, x, y, tile_type = 'floor'):
+		"carve horizontal tunnel from point and right, until it reaches passable tile or the edge of the map"
+		#find the closest passable tile in the row to the right of the point
+		row = y * self.width
+		stop = self.walkable.find(b'\x01', row + x, row + self.width)
+		if stop == -1:
+			stop = row + self.width
+		self.dig(row + x, stop, 1, tile_type)
 
 	def choose_starting_room(self):
-		"randomly choose the index of the room, where player will be placed"
-		self.starting_room = random.choice(self.rooms)
+		"randomly choose the room, where player will be placed"
+		self.starting_room = self.rooms[libtcod.random_get_int(self.rng, 0, len(self.rooms) - 1)]
 		
 
+def find_root(parents, item):
+	"root of the item's tree in union-find forest, given as list of parents (roots are their own parents); paths are shortened on the way"
+	while parents[item] != item:
+		parents[item] = parents[parents[item]]
+		item = parents[item]
+	return item
+
+def grid_squares(rect, size, margin):
+	"coordinates of the squares of the grid with certain size, that the rectangle (x1, y1, x2, y2), extended by 'margin' cells, covers"
+	(x1, y1, x2, y2) = rect
+	return [(square_x, square_y) for square_y in range((y1 - margin) / size, (y2 + margin) / size + 1)
+		for square_x in range((x1 - margin) / size, (x2 + margin) / size + 1)]
+
+def cut_tunnel(tunnel, rooms):
+	"pieces of the tunnel (x1, y1, x2, y2), which is a single row or column, outside of the rooms (rectangles of the same form)"
+	vertical = tunnel[1] != tunnel[3]
+	#work with the tunnel as if it were horizontal
+	if vertical:
+		(low, high, line) = (tunnel[1], tunnel[3], tunnel[0])
+		spans = sorted((room[1], room[3]) for room in rooms if room[0] <= line <= room[2])
+	else:
+		(low, high, line) = (tunnel[0], tunnel[2], tunnel[1])
+		spans = sorted((room[0], room[2]) for room in rooms if room[1] <= line <= room[3])
+
+	pieces = []
+	start = low
+	for (span_start, span_end) in spans:
+		if span_start > start:
+			pieces.append((start, min(span_start - 1, high)))
+		start = max(start, span_end + 1)
+	if start <= high:
+		pieces.append((start, high))
+	if vertical:
+		return [(line, start, line, end) for (start, end) in pieces]
+	return [(start, line, end, line) for (start, end) in pieces]
+
+def closest_cells(rect, other):
+	"cells (x, y) of two touching rectangles (x1, y1, x2, y2), that are next to each other (or the same cell, if they cross)"
+	def axis(low, high, other_low, other_high):
+		if high < other_low:
+			return (high, other_low)
+		if other_high < low:
+			return (low, other_high)
+		return (max(low, other_low),) * 2
+	(x, other_x) = axis(rect[0], rect[2], other[0], other[2])
+	(y, other_y) = axis(rect[1], rect[3], other[1], other[3])
+	return ((x, y), (other_x, other_y))
+
+def mix_seed(*values):
+	"mix several integers into single 32-bit seed (FNV-1a hash), used to derive seeds of chunks and their borders"
+	result = 2166136261
+	for value in values:
+		result = ((result ^ (value & 0xffffffff)) * 16777619) & 0xffffffff
+	return result
+
+class Chunk:
+	"""
+		square part of ChunkedMap, that is generated with BSP like a small GameMap
+		when the chunk is far from the player, its layers are compressed
+	"""
+	#layers, that are kept by the chunk, while it's out of the active area of the map
+	LAYERS = ('tile_type', 'walkable', 'transparent', 'occupied', 'explored')
+
+	def __init__(self, key, seed, game_map):
+		"create chunk with certain coordinates (in chunks) from freshly generated GameMap"
+		self.key = key
+		self.seed = seed
+		self.populated = False #becomes True, when enemies and items are placed in the chunk
+
+		#rooms of the chunk, shifted to the coordinates of the whole map
+		(offset_x, offset_y) = (key[0] * CHUNK_SIZE, key[1] * CHUNK_SIZE)
+		self.rooms = []
+		for room in game_map.rooms:
+			shifted = Rectangle(room.x1 + offset_x, room.y1 + offset_y, room.x2 - room.x1, room.y2 - room.y1)
+			self.rooms.append(shifted)
+			if room is game_map.starting_room:
+				self.starting_room = shifted
+		self.tunnels = [(x1 + offset_x, y1 + offset_y, x2 + offset_x, y2 + offset_y) for (x1, y1, x2, y2) in game_map.tunnels]
+
+		self.layers = dict((name, getattr(game_map, name)[:]) for name in Chunk.LAYERS) #a byte per cell, even for packed layers
+		self.packed = None #compressed layers
+
+	def pack(self):
+		"compress the layers of the chunk"
+		if self.layers is not None:
+			self.packed = zlib.compress(b''.join(bytes(self.layers[name]) for name in Chunk.LAYERS))
+			self.layers = None
+
+	def unpack(self):
+		"restore compressed layers of the chunk"
+		if self.layers is None:
+			data = zlib.decompress(self.packed)
+			size = CHUNK_SIZE * CHUNK_SIZE
+			self.layers = dict((name, bytearray(data[i * size:(i + 1) * size])) for (i, name) in enumerate(Chunk.LAYERS))
+			self.packed = None
+
+class ChunkedMap(LayeredMap):
+	"""
+		huge map, that consists of square chunks, each of them is generated only when the player comes close to it
+		map's layers cover only the active area - few chunks around the player (see LayeredMap);
+		chunks, that are far from the player, are compressed
+		neighbouring chunks are connected with tunnels, that pass through the gates on their common border
+	"""
+	def __init__(self, seed, rng, width = CHUNKED_MAP_WIDTH, height = CHUNKED_MAP_HEIGHT):
+		"create map of certain size (in cells); 'rng' is used to choose the chunk with stairs"
+		self.seed = seed
+		self.chunks_x = max(width / CHUNK_SIZE, 2) #number of chunks in a row
+		self.chunks_y = max(height / CHUNK_SIZE, 1) #number of chunks in a column
+		self.chunks = {} #all generated chunks with their coordinates (in chunks) as keys
+
+		#active area is the square of chunks around the player's chunk, but it can't go out of the map
+		self.active_x = min(2 * ACTIVE_CHUNK_RADIUS + 1, self.chunks_x) #size of the active area (in chunks)
+		self.active_y = min(2 * ACTIVE_CHUNK_RADIUS + 1, self.chunks_y)
+		self.init_layers(self.active_x * CHUNK_SIZE, self.active_y * CHUNK_SIZE)
+		self.center = None #coordinates of the chunk, the active area is centered around
+		self.area = None #coordinates of the top-left chunk of the active area
+		self.rooms = [] #rooms of the chunks in the active area; their indexes (used by connectivity index) change, when the area moves
+		self.tunnels = [] #tunnels of the chunks in the active area
+
+		#the player starts in the middle of the map, stairs are placed in a random chunk
+		self.start_chunk = (self.chunks_x / 2, self.chunks_y / 2)
+		self.stairs_chunk = self.start_chunk
+		while self.stairs_chunk == self.start_chunk:
+			self.stairs_chunk = (libtcod.random_get_int(rng, 0, self.chunks_x - 1), libtcod.random_get_int(rng, 0, self.chunks_y - 1))
+		self.starting_room = self.get_chunk(self.start_chunk).starting_room
+
+	def chunk_key(self, x, y):
+		"coordinates (in chunks) of the chunk, that contains cell (x, y)"
+		return (x / CHUNK_SIZE, y / CHUNK_SIZE)
+
+	def active_chunks(self):
+		"coordinates of all chunks in the active area"
+		(area_x, area_y) = self.area
+		return [(cx, cy) for cy in range(area_y, area_y + self.active_y) for cx in range(area_x, area_x + self.active_x)]
+
+	def gate(self, key, vertical):
+		"""
+			position of the gate on the right (if 'vertical' is True) or the bottom border of the chunk
+			it's derived from the map's seed, so both chunks, that share the border, know it
+		"""
+		return 2 + mix_seed(self.seed, key[0], key[1], vertical) % (CHUNK_SIZE - 4)
+
+	def get_chunk(self, key):
+		"return the chunk with certain coordinates, generate it if necessary"
+		chunk = self.chunks.get(key)
+		if chunk is not None:
+			return chunk
+
+		seed = mix_seed(self.seed, key[0], key[1])
+		rng = libtcod.random_new_from_seed(seed)
+		chunk_map = GameMap(rng, CHUNK_SIZE, CHUNK_SIZE)
+		libtcod.random_delete(rng)
+
+		#dig tunnels from the gates on the borders of the chunk until they reach passable tiles
+		(cx, cy) = key
+		last = CHUNK_SIZE - 1
+		if cx > 0:
+			chunk_map.create_hor_line_right(0, self.gate((cx - 1, cy), True))
+		if cx < self.chunks_x - 1:
+			chunk_map.create_hor_line_left(last, self.gate(key, True))
+		if cy > 0:
+			chunk_map.create_vert_line_down(self.gate((cx, cy - 1), False), 0)
+		if cy < self.chunks_y - 1:
+			chunk_map.create_vert_line_up(self.gate(key, False), last)
+
+		chunk = Chunk(key, seed, chunk_map)
+		self.chunks[key] = chunk
+		return chunk
+
+	def copy_chunk(self, chunk, to_layers):
+		"copy layers of the chunk into the active area of the map (or back, if 'to_layers' is False) row by row"
+		(left, top) = (chunk.key[0] * CHUNK_SIZE - self.x0, chunk.key[1] * CHUNK_SIZE - self.y0)
+		for name in Chunk.LAYERS:
+			chunk_layer = chunk.layers[name]
+			map_layer = getattr(self, name)
+			for row in range(CHUNK_SIZE):
+				start = (top + row) * self.width + left
+				if to_layers:
+					map_layer[start:start + CHUNK_SIZE] = chunk_layer[row * CHUNK_SIZE:(row + 1) * CHUNK_SIZE]
+				else:
+					chunk_layer[row * CHUNK_SIZE:(row + 1) * CHUNK_SIZE] = map_layer[start:start + CHUNK_SIZE]
+
+	def focus(self, x, y):
+		"""
+			move the active area, so the chunk with the cell (x, y) is in its center
+			returns the list of chunks in the active area, that are not filled with objects yet, or None if the area hasn't moved
+		"""
+		key = self.chunk_key(x, y)
+		if key == self.center:
+			return None
+		self.center = key
+
+		#save the state of the previous active area
+		if self.area is not None:
+			for chunk_key in self.active_chunks():
+				self.copy_chunk(self.chunks[chunk_key], False)
+
+		area_x = min(max(key[0] - ACTIVE_CHUNK_RADIUS, 0), self.chunks_x - self.active_x)
+		area_y = min(max(key[1] - ACTIVE_CHUNK_RADIUS, 0), self.chunks_y - self.active_y)
+		self.area = (area_x, area_y)
+		(self.x0, self.y0) = (area_x * CHUNK_SIZE, area_y * CHUNK_SIZE)
+
+		#fill the layers with the chunks of the new active area
+		self.init_layers(self.width, self.height)
+		self.rooms = []
+		self.tunnels = []
+		new_chunks = []
+		for chunk_key in self.active_chunks():
+			chunk = self.get_chunk(chunk_key)
+			chunk.unpack()
+			self.copy_chunk(chunk, True)
+			self.rooms.extend(chunk.rooms)
+			self.tunnels.extend(chunk.tunnels)
+			if not chunk.populated:
+				chunk.populated = True
+				new_chunks.append(chunk)
+		self.build_room_index()
+		self.build_free_cells()
+
+		#compress chunks, that are far away from the active area
+		for ((cx, cy), chunk) in self.chunks.items():
+			distance_x = max(area_x - cx, cx - (area_x + self.active_x - 1), 0)
+			distance_y = max(area_y - cy, cy - (area_y + self.active_y - 1), 0)
+			if max(distance_x, distance_y) > CHUNK_UNLOAD_DISTANCE:
+				chunk.pack()
+
+		return new_chunks
+
 class Rectangle:
 	"a rectangle on the map, used to characterize a room"
 	def __init__(self, x, y, width, height):
@@ -327,5 +1340,44 @@ class Rectangle:
 		"returns True if two rooms intersect"
 		return (self.x1 <= other.x2 and self.y1 <= other.y2 and self.x2 >= other.x1 and self.y2 >= other.y1)
 
+	def inside(self, x, y):
+		"returns True if the point lies inside the room, not on its border"
+		return self.x1 < x < self.x2 and self.y1 < y < self.y2
+
+class FreeCells:
+	"""
+		set of cell indexes, that supports adding, removing and choosing a random cell in constant time
+		used by rooms to track cells, where something can be placed
+	"""
+	def __init__(self):
+		self.cells = [] #cells in no particular order
+		self.positions = {} #position of every cell in 'cells'
+
+	def __len__(self):
+		return len(self.cells)
+
+	def __contains__(self, cell):
+		return cell in self.positions
+
+	def add(self, cell):
+		if cell not in self.positions:
+			self.positions[cell] = len(self.cells)
+			self.cells.append(cell)
+
+	def remove(self, cell):
+		"remove the cell (if it's in the set) by moving the last cell to its place"
+		position = self.positions.pop(cell, None)
+		if position is not None:
+			last = self.cells.pop()
+			if last != cell:
+				self.cells[position] = last
+				self.positions[last] = position
+
+	def sample(self, rng):
+		"random cell, chosen with libtcod random generator 'rng', or None if the set is empty"
+		if not self.cells:
+			return None
+		return self.cells[libtcod.random_get_int(rng, 0, len(self.cells) - 1)]
+
 
 
@@ -1,9 +1,10 @@
-from random import choice
+import random
 from globs import *
 from gamelog import GameLog
-from gamemap import StationLevel
+from levelgen import LevelPregenerator, VisitedLevels, generate_level, attach_level, level_seed
 from item import add_item_to_char
 from character import generate_player
+from AI import Planner
 
 #-----------------------------
 #~~~~~~~~~~~~~~~~~~~~~~~
@@ -19,7 +20,8 @@ class GameState:
 		it is intended to be universal argument for almost every function
 		the best (not really) solution I've figured out so far
 	"""
-	def __init__(self, current_level, player, log, consols):
+	def __init__(self, seed, current_level, player, log, consols):
+		self.seed = seed #seed of the whole game, seeds of all levels are derived from it
 		self.location = current_level #GameMap instance, game level as it is
 		self.player = player #Player instance, represents the one and only player
 		self.log = log #GameLog instance, message log of the current game session
@@ -29,10 +31,21 @@ class GameState:
 		self.game_state = 'playing'
 		self.consols = consols #libtcod consols dict; consols are used in most UI-functions
 		self.camera_pos = (None, None)
+		self.rendered = None #(level map, revision of its journal, camera position) of the last rendered frame, see 'render_tiles'
+		self.pregen = LevelPregenerator(seed) #builds next station levels in the background
+		self.levels = VisitedLevels(seed) #levels, that the player has left, but can return to
+		self.planner = Planner() #keeps enemies' planning within the time budget of a frame
 
-def init_new_game():
+		#start building the next level right away
+		self.pregen.request(self.location.level - 1)
+
+def init_new_game(seed = GAME_SEED):
 	"start off a new game session; constructs new GameState instance"
-	current_level = StationLevel(10) #starting with level 10
+	if seed is None:
+		seed = random.getrandbits(32)
+
+	#starting with the first level of the station
+	current_level = attach_level(generate_level(FIRST_LEVEL, level_seed(seed, FIRST_LEVEL)))
 	local_map = current_level.level_map
 
 	#player creation and placing
@@ -50,11 +63,13 @@ def init_new_game():
 	map_console = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)
 	#off-screen console for stats panel
 	panel_console = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
-	consols = {'map': map_console, 'panel': panel_console}
+	#spare console of the same size as the map one, used to scroll it (see 'scroll_console')
+	scroll_console = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)
+	consols = {'map': map_console, 'panel': panel_console, 'scroll': scroll_console}
 	
 	log = GameLog()
 	
-	current_game = GameState(current_level, player, log, consols)
+	current_game = GameState(seed, current_level, player, log, consols)
 	return current_game
 
 
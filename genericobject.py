@@ -42,11 +42,12 @@ class Object:
 			return False
 	
 	def draw(self, camera_pos, console):
-		"draw the character that represents this object at its position"
+		"draw the character that represents this object at its position; background of the cell is left to 'render_tiles'"
 		(x, y) = to_camera_coordinates(camera_pos, self.pos.x, self.pos.y)
 		if x is not None:
 			if self.pos.is_in_fov or (self.always_visible and self.pos.explored):
-				libtcod.console_put_char_ex(console, x, y, self.icon, self.color, libtcod.BKGND_DEFAULT)
+				libtcod.console_set_char(console, x, y, self.icon)
+				libtcod.console_set_char_foreground(console, x, y, self.color)
 		
 	def clear(self, camera_pos, console):
 		"erase the character that represents this object"
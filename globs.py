@@ -27,6 +27,35 @@ MAX_ROOM_ITEMS = 3
 DEPTH = 10 #number of node splittings
 ROOM_MIN_SIZE = 6
 FULL_ROOMS = False
+#how often (in seconds) the game checks, whether the next level has been generated in the background
+PREGEN_POLL_TIME = 0.1
+#chunked levels are huge levels, that are generated chunk by chunk, while the player explores them
+CHUNKED_LEVELS = False
+CHUNKED_MAP_WIDTH = 1000
+CHUNKED_MAP_HEIGHT = 1000
+CHUNK_SIZE = 50
+ACTIVE_CHUNK_RADIUS = 1 #only chunks within this distance (in chunks) from the player's one are kept in the map layers
+CHUNK_UNLOAD_DISTANCE = 2 #chunks farther from the active area are compressed
+#seed of the whole station, every level's seed is derived from it; random seed is used if it's None
+GAME_SEED = None
+#mixed into the level's seed to get a separate random stream for placing objects
+SPAWN_SEED_SALT = 0x5bd1e995
+#generated levels are cached on disk in this folder; caching is disabled if it's None
+#levels are cached only when GAME_SEED is set, because random seeds are almost never used again
+LEVEL_CACHE_DIR = 'levelcache'
+#total size of the cached levels in bytes; the least recently used ones are deleted, when it's exceeded
+LEVEL_CACHE_BUDGET = 64 * 1024 * 1024
+#should be increased on every change of the generator, so outdated levels from the cache are not used
+LEVEL_CACHE_VERSION = 12
+#number of the level, the game starts on; the player goes up to the lower numbers
+FIRST_LEVEL = 10
+#visited levels are kept, so the player can return to them:
+#a few most recent ones are kept as they are, older ones are compressed, and the oldest compressed levels are spilled to disk,
+#as soon as all compressed levels take more memory, than the budget (in bytes)
+VISITED_LEVELS_KEPT = 2
+VISITED_LEVELS_BUDGET = 4 * 1024 * 1024
+#folder for spilled levels; if it's None, levels are never spilled and the budget is not enforced
+VISITED_LEVELS_DIR = 'levelcache'
 
 #sizes and coordinates for GUI
 PANEL_HEIGHT = 7
@@ -58,9 +87,40 @@ LEVEL_UP_BASE = 100
 LEVEL_UP_FACTOR = 150
 
 #FOV properties
+#FOV engine: 'libtcod' uses libtcod algorithm FOV_ALGO, 'shadowcasting' computes FOV right on the map layers (see 'fov.py')
+FOV_ENGINE = 'libtcod'
 FOV_ALGO = 0
 FOV_LIGHT_WALLS = True
 TORCH_RADIUS = 10
+#how far enemies can see; while it's equal to TORCH_RADIUS, enemies' perception reuses the player's field of view
+ENEMY_SIGHT_RADIUS = TORCH_RADIUS
+#number of the latest changes of map cells, that are kept by every level (see 'journal.py')
+JOURNAL_SIZE = 4096
+#number of computed fields of view, that are kept by every level to be reused
+FOV_CACHE_SIZE = 256
+
+#time properties
+#units of time, that single action takes for a character of normal speed; faster characters act more often (see 'scheduler.py')
+ACTION_TIME = 100
+NORMAL_SPEED = 100
+
+#AI properties
+#enemies, that are farther from the player and don't see him, fall asleep and don't take turns, until something wakes them up
+DORMANT_DISTANCE = 2 * TORCH_RADIUS
+#dormant enemies within this distance (in cells) from the fight are woken up by its noise
+NOISE_RADIUS = 8
+#time in seconds, that enemies may spend on planning (path search) during single frame; the rest of it is postponed to idle frames
+AI_FRAME_BUDGET = 0.01
+#make decisions of all enemies, that act at the same time, together with numpy (see 'AI.batch_turn'); ignored without numpy
+BATCH_AI = False
+#print statistics of the AI time budget (see 'AI.Planner.report'), when the game is left
+AI_DEBUG = False
+
+#pathfinding properties
+#how far the target can move away from the end of the character's path, before the path is computed again
+PATH_DRIFT = 2
+#how many turns the character waits, while others stand in the way and can't be walked around, before it gives up the path
+PATH_PATIENCE = 5
 
 ##########################################################
 
@@ -85,10 +145,15 @@ c_hi_floor = libtcod.Color(105, 150, 211)
 #
 #in order to add new type, just create additional dict holding its properties as shown below and append it to 'TYLE_TYPES'
 #'tile_type' used in 'Tile.set_type' is the keyword of a corresponding type in 'TILE_TYPES'
+#
+#GameMap stores types of its tiles as small integers - indexes in 'TILE_PALETTE', so new types also should be appended there
+#every type is turned into a single immutable 'TileType' record (see 'gamemap.py'), that is shared by all tiles of this type
 
 floor = {'title': 'f1loor', 'walkable': True, 'transparent': True, 'vis_color': c_vis_floor, 'hid_color': c_hid_floor, 'hi_color': c_hi_floor}
 wall = {'title': 'metal wall', 'walkable': False, 'transparent': False, 'vis_color': c_vis_wall, 'hid_color': c_hid_wall, 'hi_color': c_hi_wall}
 TILE_TYPES = {'floor': floor, 'wall': wall}
+TILE_PALETTE = ('wall', 'floor')
+TILE_IDS = dict((title, i) for (i, title) in enumerate(TILE_PALETTE))
 
 #variables for input handling
 #they are kept here, as they don't hold any used information outside input-handling functions
@@ -10,9 +10,19 @@ from globs import *
 
 def render_all(game):
 	"render map, GUI and all in-game objects"
-	game.camera_pos = move_camera(game.camera_pos, game.player.pos.x, game.player.pos.y)
+	#on chunked levels, only the area around the player is kept in memory
+	if game.location.update_active_area(game.player.pos.x, game.player.pos.y):
+		game.player.release_fov()
+		game.player.init_fov()
+		libtcod.console_clear(game.consols['map'])
+		game.rendered = None
+
+	game.camera_pos = move_camera(game.camera_pos, game.player.pos.x, game.player.pos.y, game.location.level_map)
 	game.player.compute_fov()
 
+	#tiles go first, as the map console is scrolled with the camera, and objects should stay where they are drawn
+	render_tiles(game)
+
 	#draw environment, including stairs
 	for obj in game.location.environment: obj.draw(game.camera_pos, game.consols['map'])
 	#draw all items on the level first
@@ -20,8 +30,6 @@ def render_all(game):
 	#draw all characters on the level
 	for character in game.location.characters: character.draw(game.camera_pos, game.consols['map'])
 	game.player.draw(game.camera_pos, game.consols['map'])
-	
-	render_tiles(game)
 
 	#blit the contents of "map_console" to the root console
 	libtcod.console_blit(game.consols['map'], 0, 0, CAMERA_WIDTH, CAMERA_HEIGHT, 0, 0, 0)
@@ -47,13 +55,52 @@ def render_all(game):
 	libtcod.console_blit(game.consols['panel'], 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
 
 def render_tiles(game):
-	"go through all tiles, and set their background color"
-	local_map = game.location.level_map.map_grid
-	for y in range(CAMERA_HEIGHT):
-		for x in range(CAMERA_WIDTH):
-			(map_x, map_y) = (game.camera_pos[0] + x, game.camera_pos[1] + y)
-			color = local_map[map_x][map_y].calculate_color()
-			libtcod.console_set_char_background(game.consols['map'], x, y, color, libtcod.BKGND_SET)
+	"""
+		set background color of the tiles, that have changed since the last frame (according to the journal of the map)
+		when the camera moves, the old contents of the map console are scrolled with it, so only the edge, that comes into view, is drawn
+		all tiles are redrawn only if the map has changed, the camera has moved by the whole screen, or the journal has forgotten some changes
+	"""
+	local_map = game.location.level_map
+	(camera_x, camera_y) = game.camera_pos
+
+	changes = None
+	if game.rendered is not None and game.rendered[0] is local_map:
+		changes = local_map.journal.changes_since(game.rendered[1])
+		(shift_x, shift_y) = (camera_x - game.rendered[2][0], camera_y - game.rendered[2][1])
+		if abs(shift_x) >= CAMERA_WIDTH or abs(shift_y) >= CAMERA_HEIGHT:
+			changes = None
+	game.rendered = (local_map, local_map.journal.revision, game.camera_pos)
+
+	if changes is None:
+		for y in range(CAMERA_HEIGHT):
+			for x in range(CAMERA_WIDTH):
+				color = local_map.calculate_color(local_map.index(camera_x + x, camera_y + y))
+				libtcod.console_set_char_background(game.consols['map'], x, y, color, libtcod.BKGND_SET)
+		return
+
+	#occupation of the cell doesn't affect its color
+	cells = set(i for (layer, i) in changes if layer != 'occupied')
+	if shift_x or shift_y:
+		scroll_console(game.consols['map'], game.consols['scroll'], shift_x, shift_y)
+		#columns and rows of the screen, that have come into view
+		columns = range(CAMERA_WIDTH - shift_x, CAMERA_WIDTH) if shift_x > 0 else range(-shift_x)
+		rows = range(CAMERA_HEIGHT - shift_y, CAMERA_HEIGHT) if shift_y > 0 else range(-shift_y)
+		for x in columns:
+			cells.update(local_map.index(camera_x + x, camera_y + y) for y in range(CAMERA_HEIGHT))
+		for y in rows:
+			cells.update(local_map.index(camera_x + x, camera_y + y) for x in range(CAMERA_WIDTH))
+
+	width = local_map.width
+	for i in cells:
+		(x, y) = (i % width + local_map.x0 - camera_x, i / width + local_map.y0 - camera_y)
+		if 0 <= x < CAMERA_WIDTH and 0 <= y < CAMERA_HEIGHT:
+			libtcod.console_set_char_background(game.consols['map'], x, y, local_map.calculate_color(i), libtcod.BKGND_SET)
+
+def scroll_console(console, spare, shift_x, shift_y):
+	"move the contents of the camera-sized console by (-shift_x, -shift_y), when the camera moves by (shift_x, shift_y); 'spare' is the console of the same size"
+	(width, height) = (CAMERA_WIDTH - abs(shift_x), CAMERA_HEIGHT - abs(shift_y))
+	libtcod.console_blit(console, max(shift_x, 0), max(shift_y, 0), width, height, spare, 0, 0)
+	libtcod.console_blit(spare, 0, 0, width, height, console, max(-shift_x, 0), max(-shift_y, 0))
 
 def clear_all(game):
 	"erase all object icons from their position"
@@ -65,17 +112,17 @@ def clear_all(game):
 	for obj in game.location.environment:
 		obj.clear(game.camera_pos, game.consols['map'])
 
-def move_camera(camera_pos, target_x, target_y):
+def move_camera(camera_pos, target_x, target_y, level_map):
 	"move the camera, so the (target_x, target_y) is the center"
 	#new camera coordinates (top-left corner of the screen relative to the map)
 	x = target_x - CAMERA_WIDTH / 2  #coordinates so that the target is at the center of the screen
 	y = target_y - CAMERA_HEIGHT / 2
  
-	#make sure the camera doesn't see outside the map
-	if x < 0: x = 0
-	if y < 0: y = 0
-	if x > MAP_WIDTH - CAMERA_WIDTH: x = MAP_WIDTH - CAMERA_WIDTH
-	if y > MAP_HEIGHT - CAMERA_HEIGHT: y = MAP_HEIGHT - CAMERA_HEIGHT
+	#make sure the camera doesn't see outside the map (or its active part)
+	if x < level_map.x0: x = level_map.x0
+	if y < level_map.y0: y = level_map.y0
+	if x > level_map.x0 + level_map.width - CAMERA_WIDTH: x = level_map.x0 + level_map.width - CAMERA_WIDTH
+	if y > level_map.y0 + level_map.height - CAMERA_HEIGHT: y = level_map.y0 + level_map.height - CAMERA_HEIGHT
 
 	return (x, y)
 
@@ -212,6 +259,15 @@ def msgbox(text, width=50):
 	"can be used for warning message"
 	menu(text, [], width)
 
+def show_progress(text, seconds):
+	"show the message with animated dots, while the player is waiting for something; doesn't wait for input"
+	dots = '.' * (int(seconds * 4) % 4)
+	libtcod.console_set_default_background(0, libtcod.black)
+	libtcod.console_rect(0, 0, SCREEN_HEIGHT / 2, SCREEN_WIDTH, 1, True, libtcod.BKGND_SET)
+	libtcod.console_set_default_foreground(0, libtcod.white)
+	libtcod.console_print_ex(0, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, libtcod.BKGND_NONE, libtcod.CENTER, text + dots.ljust(3))
+	libtcod.console_flush()
+
 def inventory_menu(player, header):
 	"show a menu with each item of the inventory as an option"
 	if len(player.inventory) == 0:
@@ -280,7 +336,7 @@ def handle_keys(game):
 			#picking up the item
 			for item in game.location.items:
 				if player.is_here(item.pos.x, item.pos.y):
-					item.pick_up(game.log, player, game.location.items)
+					item.pick_up(game.log, player, game.location)
 					break
 
 		elif key_char == 'i':
@@ -299,15 +355,16 @@ def handle_keys(game):
 			#open the drop menu
 			chosen_item = inventory_menu(player, 'Press the key next to an item to drop it, or any other to cancel.\n')
 			if chosen_item is not None:
-				chosen_item.drop(game.log, game.location.items)
+				chosen_item.drop(game.log, game.location)
 			else:
 				player.state = 'idle'
 
-		elif key_char == '<':
-			#go down stairs
-			stairs = game.location.environment[0]
-			if player.is_here(stairs.pos.x, stairs.pos.y):
-				stairs.interact(game)
+		elif key_char in ('<', '>'):
+			#take the stairs to the next level ('<') or back to the previous one ('>')
+			for stairs in game.location.environment:
+				if player.is_here(stairs.pos.x, stairs.pos.y) and stairs.icon == key_char:
+					stairs.interact(game)
+					break
 
 		elif key_char == 'f':
 			#shoot a target with your weapon
@@ -323,9 +380,7 @@ def handle_keys(game):
 
 		elif key_char == 's':
 			#just for test; shows whole map
-			for tile_row in player.entire_map:
-				for tile in tile_row:
-					tile.explored = True
+			player.entire_map.reveal()
 
 		else: player.state = 'idle' #if pressed no key or keys that aren't available
 
@@ -51,24 +51,24 @@ class Item(Object):
 			if owner_is_player:
 				self.owner.state = 'acted'
 	
-	def pick_up(self, log, character, level_items):
+	def pick_up(self, log, character, station_level):
 		"add an item to the inventory and remove from the map"
 		if len(character.inventory) >= MAX_INVENTORY_SIZE:
 			log.message('Your inventory is full, cannot pick up the' + self.name + '.', libtcod.darker_red)
 			if 'state' in self.owner.__dict__:
 				self.owner.state = 'idle'
 		else:
+			station_level.remove_item(self)
 			character.add_item(self)
-			level_items.remove(self)
 			log.message('You picked up a ' + self.name + '!', libtcod.green)	
 			if 'state' in self.owner.__dict__:
 				self.owner.state = 'acted'
 
-	def drop(self, log, level_items):
+	def drop(self, log, station_level):
 		"add an item to the map and remove from the character's inventory, place it at the character's coordinates"
 		self.owner.inventory.remove(self)
-		level_items.append(self)
 		self.pos = self.owner.pos
+		station_level.add_item(self)
 
 		if 'state' in self.owner.__dict__:
 			self.owner.state = 'acted'
@@ -126,7 +126,7 @@ def add_item_to_lvl(station_level, x, y, item_id):
 	"generate new item and place add it on the map"
 	item = generate_item(item_id)
 	item.pos = station_level.level_map.map_grid[x][y]
-	station_level.items.append(item)
+	station_level.add_item(item)
 
 ##########################################################
 # Item use functions
@@ -163,6 +163,7 @@ def item_modulator(game):
 		old_ai = enemy.ai
 		enemy.ai = ConfusedAI(old_ai)
 		enemy.ai.owner = enemy
+		enemy.ai.start(game)
 		game.log.message('The metal eyes of the ' + enemy.name + ' stop glowing, as he starts to stumble around!', libtcod.light_green)
 
 def item_grenade(game):
@@ -0,0 +1,60 @@
+from collections import deque
+from itertools import islice
+from globs import *
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# ChangeJournal
+# Journal of the changes of map cells, that keeps structures derived from the map up to date
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+class ChangeJournal:
+	"""
+		every change of a map cell is recorded here and gets its own revision number
+		structures, derived from the map layers (FOV maps, caches, the screen), remember the last revision they have seen
+		and apply only the changes made since then (see 'changes_since')
+		only the latest changes are kept, so the structure, that has missed too many of them, has to be rebuilt
+	"""
+	def __init__(self, size = JOURNAL_SIZE):
+		"create empty journal, that keeps up to 'size' latest changes"
+		self.revision = 0 #revision of the latest change
+		self.base = 0 #the oldest revision, that can be brought up to date by the kept changes
+		self.changes = deque(maxlen = size) #tuples (layer, index) with revisions from 'base' + 1 to 'revision'
+		self.layer_revisions = {} #revisions of the latest change of every layer with the name of the layer as key
+
+	def __getstate__(self):
+		"changes aren't saved: anything, that is derived from the map, is rebuilt after loading anyway"
+		state = self.__dict__.copy()
+		state['changes'] = deque(maxlen = self.changes.maxlen)
+		state['base'] = self.revision
+		return state
+
+	def record(self, layer, i):
+		"register the change of the cell with index 'i' in the layer with certain name"
+		self.revision += 1
+		if len(self.changes) == self.changes.maxlen:
+			self.base += 1 #the oldest change is forgotten
+		self.changes.append((layer, i))
+		self.layer_revisions[layer] = self.revision
+
+	def invalidate(self, layers):
+		"register the change of all cells of the layers at once, so every structure, that depends on the map, has to be rebuilt"
+		self.revision += 1
+		self.base = self.revision
+		self.changes.clear()
+		for layer in layers:
+			self.layer_revisions[layer] = self.revision
+
+	def changes_since(self, revision):
+		"list of changes (layer, index) made after certain revision, or None if some of them are forgotten and everything should be rebuilt"
+		if revision < self.base:
+			return None
+		#the latest changes are at the end of the deque, so it's walked from there, and only the needed ones are taken
+		changes = list(islice(reversed(self.changes), self.revision - revision))
+		changes.reverse()
+		return changes
+
+	def layer_revision(self, *layers):
+		"revision of the latest change of any of the layers"
+		return max(self.layer_revisions.get(layer, 0) for layer in layers)
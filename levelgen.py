@@ -0,0 +1,283 @@
+import os
+import zlib
+import cPickle
+import multiprocessing
+from gamemap import StationLevel
+from globs import *
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# LevelPregenerator, GeneratedLevelCache, VisitedLevels
+# Functions, related to generating station levels in the background and reusing already generated or visited ones
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+def level_seed(game_seed, level):
+	"seed of the certain level of the station, derived from the seed of the whole game"
+	return (game_seed * 1000003 + level) & 0xffffffff
+
+def generate_level(level, seed, cache_dir = LEVEL_CACHE_DIR):
+	"""
+		construct new StationLevel or load it from the cache, ready to be passed between processes
+		native libtcod handles are valid only in the process, that has created them, so they are released here
+		and have to be recreated by the receiver (see 'attach_level')
+	"""
+	if GAME_SEED is None:
+		cache_dir = None
+	cache = GeneratedLevelCache(cache_dir)
+	new_level = cache.load(seed, level)
+	if new_level is None:
+		new_level = StationLevel(level, seed)
+		new_level.release_fov()
+		cache.save(new_level)
+	return new_level
+
+def attach_level(new_level):
+	"prepare FOV of the characters of the level, that has been generated in another process or loaded from disk"
+	for char in new_level.characters:
+		char.init_fov()
+	return new_level
+
+def level_layout():
+	"name of the kind and size of the maps, that are generated with current settings, i. e. 'map100x80' or 'chunked1000x1000_50'"
+	if CHUNKED_LEVELS:
+		return 'chunked%dx%d_%d' % (CHUNKED_MAP_WIDTH, CHUNKED_MAP_HEIGHT, CHUNK_SIZE)
+	return 'map%dx%d' % (MAP_WIDTH, MAP_HEIGHT)
+
+class GeneratedLevelCache:
+	"""
+		on-disk storage of freshly generated levels, one file per (seed, level, layout of the map)
+		as generation is fully determined by them, stored level can be used instead of building it again
+		total size of the files is kept within the budget by deleting the least recently used ones
+	"""
+	def __init__(self, directory = LEVEL_CACHE_DIR, budget = LEVEL_CACHE_BUDGET):
+		"create cache in the certain folder; if 'directory' is None, cache never stores anything"
+		self.directory = directory
+		self.budget = budget
+
+	def path(self, seed, level):
+		"name of the file, that holds the level"
+		return os.path.join(self.directory, 'level_%d_%d_%s.lvl' % (seed, level, level_layout()))
+
+	def load(self, seed, level):
+		"return cached level or None, if there is no such level (or it was generated by outdated generator)"
+		if self.directory is None:
+			return None
+
+		try:
+			with open(self.path(seed, level), 'rb') as cache_file:
+				(version, cached_level) = cPickle.load(cache_file)
+		except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+			return None
+
+		if version != LEVEL_CACHE_VERSION:
+			return None
+
+		try: #the time of the last use is the time of modification of the file
+			os.utime(self.path(seed, level), None)
+		except OSError:
+			pass
+		return cached_level
+
+	def save(self, new_level):
+		"store freshly generated level; level's FOV maps should be released beforehand"
+		if self.directory is None:
+			return
+
+		if not os.path.isdir(self.directory):
+			try:
+				os.makedirs(self.directory)
+			except OSError: #the folder could be created by another process in the meantime
+				pass
+
+		#write to a temporary file first, so the other process never reads half-written level
+		path = self.path(new_level.seed, new_level.level)
+		temp_path = path + '.%d.tmp' % os.getpid()
+		with open(temp_path, 'wb') as cache_file:
+			cPickle.dump((LEVEL_CACHE_VERSION, new_level), cache_file, cPickle.HIGHEST_PROTOCOL)
+		if os.path.exists(path):
+			os.remove(path)
+		os.rename(temp_path, path)
+		self.shrink()
+
+	def shrink(self):
+		"delete the least recently used levels, until the cache fits into the budget"
+		files = []
+		for name in os.listdir(self.directory):
+			if name.startswith('level_') and name.endswith('.lvl'):
+				path = os.path.join(self.directory, name)
+				try:
+					files.append((os.path.getmtime(path), os.path.getsize(path), path))
+				except OSError: #deleted by another process
+					pass
+
+		total = sum(size for (used, size, path) in files)
+		for (used, size, path) in sorted(files):
+			if total <= self.budget:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+class LevelPregenerator:
+	"""
+		builds the next levels of the station in a separate worker process
+		while the player is exploring the current one, so taking the stairs doesn't cause a hitch
+	"""
+	def __init__(self, game_seed):
+		"create pregenerator for the game with certain seed; worker process is started on the first request"
+		self.game_seed = game_seed
+		self.pool = None
+		self.pending = {} #results of requested generations, presented by AsyncResult instances with level number as key
+
+	def request(self, level):
+		"start generating the level in the background, if it hasn't been started yet"
+		if level in self.pending:
+			return
+
+		if self.pool is None:
+			self.pool = multiprocessing.Pool(processes = 1)
+		self.pending[level] = self.pool.apply_async(generate_level, (level, level_seed(self.game_seed, level)))
+
+	def get(self, level, wait_callback = None):
+		"""
+			return generated level; if it isn't finished yet, wait for it
+			'wait_callback' is called repeatedly while waiting with the number of seconds passed, so it can show a progress indicator
+			if the level wasn't requested or the worker has failed, the level is generated right away
+		"""
+		result = self.pending.pop(level, None)
+		if result is not None:
+			waited = 0.0
+			while not result.ready():
+				if wait_callback is not None:
+					wait_callback(waited)
+				result.wait(PREGEN_POLL_TIME)
+				waited += PREGEN_POLL_TIME
+
+			if result.successful():
+				new_level = result.get()
+			else:
+				new_level = generate_level(level, level_seed(self.game_seed, level))
+		else:
+			new_level = generate_level(level, level_seed(self.game_seed, level))
+
+		return attach_level(new_level)
+
+	def close(self):
+		"""
+			stop the worker process and forget about unfinished levels
+			the worker is let to finish the level it's building: terminating the pool, while the worker is idle, may hang on Python 2
+		"""
+		self.pending = {}
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+class VisitedLevels:
+	"""
+		levels of the station, that the player has left; they are kept, so the player can return to them
+		a few most recently left levels are kept as they are, older ones are pickled and compressed,
+		and as soon as compressed levels take more memory than the budget, the least recently used of them are spilled to disk
+	"""
+	def __init__(self, game_seed, kept = VISITED_LEVELS_KEPT, budget = VISITED_LEVELS_BUDGET, directory = VISITED_LEVELS_DIR):
+		"create empty storage for the game with certain seed; if 'directory' is None, levels are never spilled"
+		self.game_seed = game_seed
+		self.kept_limit = kept
+		self.budget = budget
+		self.directory = directory
+
+		#dicts with level numbers as keys
+		self.kept = {} #StationLevel instances
+		self.compressed = {} #compressed pickles of levels
+		self.spilled = {} #names of files, that hold spilled levels
+		self.order = [] #numbers of all stored levels, the most recently left one is the last
+
+		#how many levels were stored, found on every tier or not found at all, and moved to the lower tier
+		self.stats = dict.fromkeys(('stored', 'kept_hits', 'compressed_hits', 'spilled_hits', 'misses', 'compressions', 'spills'), 0)
+
+	def __contains__(self, number):
+		return number in self.kept or number in self.compressed or number in self.spilled
+
+	def __len__(self):
+		return len(self.order)
+
+	def memory_used(self):
+		"bytes taken by compressed levels"
+		return sum(len(data) for data in self.compressed.values())
+
+	def path(self, number):
+		"name of the file for the spilled level"
+		return os.path.join(self.directory, 'visited_%d_%d.lvl' % (self.game_seed, number))
+
+	def store(self, station_level):
+		"keep the level, that the player has just left; its native libtcod handles are released"
+		station_level.release_fov()
+
+		number = station_level.level
+		self.discard(number)
+		self.kept[number] = station_level
+		self.order.append(number)
+		self.stats['stored'] += 1
+		self.shrink()
+
+	def take(self, number):
+		"remove the level from the storage and return it, ready to be played; returns None if the level hasn't been visited"
+		if number in self.kept:
+			station_level = self.kept.pop(number)
+			self.stats['kept_hits'] += 1
+		elif number in self.compressed:
+			station_level = cPickle.loads(zlib.decompress(self.compressed.pop(number)))
+			self.stats['compressed_hits'] += 1
+		elif number in self.spilled:
+			path = self.spilled.pop(number)
+			with open(path, 'rb') as spill_file:
+				station_level = cPickle.loads(zlib.decompress(spill_file.read()))
+			os.remove(path)
+			self.stats['spilled_hits'] += 1
+		else:
+			self.stats['misses'] += 1
+			return None
+
+		self.order.remove(number)
+		return attach_level(station_level)
+
+	def discard(self, number):
+		"forget the level, if it's stored"
+		if number in self.spilled:
+			os.remove(self.spilled.pop(number))
+		self.kept.pop(number, None)
+		self.compressed.pop(number, None)
+		if number in self.order:
+			self.order.remove(number)
+
+	def shrink(self):
+		"compress levels, that don't fit in the number of kept ones, and spill the oldest compressed levels, that don't fit in the budget"
+		kept = [number for number in self.order if number in self.kept]
+		for number in kept[:max(len(kept) - self.kept_limit, 0)]:
+			self.compressed[number] = zlib.compress(cPickle.dumps(self.kept.pop(number), cPickle.HIGHEST_PROTOCOL))
+			self.stats['compressions'] += 1
+
+		if self.directory is None:
+			return
+
+		used = self.memory_used()
+		for number in [number for number in self.order if number in self.compressed]:
+			if used <= self.budget:
+				break
+
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			data = self.compressed.pop(number)
+			with open(self.path(number), 'wb') as spill_file:
+				spill_file.write(data)
+			self.spilled[number] = self.path(number)
+			used -= len(data)
+			self.stats['spills'] += 1
+
+	def clear(self):
+		"forget all stored levels and delete spilled files"
+		for number in list(self.order):
+			self.discard(number)
@@ -1,5 +1,8 @@
 import shelve
+import multiprocessing
 from gamestate import init_new_game
+from levelgen import LevelPregenerator
+from AI import perceive, batch_turn
 from interface import *
 
 #-----------------------------
@@ -21,6 +24,12 @@ def new_game():
 
 	return current_game
 
+def close_game(game):
+	"stop generating levels in the background for the game, that won't be played anymore (it does nothing with None)"
+	if game is not None and game.pregen is not None:
+		game.pregen.close()
+		game.pregen = None
+
 def play_game(game):
 	"start main game loop"
 
@@ -44,14 +53,21 @@ def play_game(game):
 		if event != 0:
 			result = handle_keys(game)
 			if result == 'exit':
+				if AI_DEBUG:
+					print game.planner.report()
 				return game
 		else: #if no keys pressed and mouse clicks, player remains 'idle'
 			game.player.state = 'idle'
 
 		#if game is not interrupted and the player made his move, NPCs take their turn
+		#planning, that doesn't fit into the frame, is done later, while the player is idle
 		if game.game_state == 'playing' and game.player.state != 'idle':
-			for char in game.location.characters:
-				char.ai.take_turn(game, game.player)
+			game.planner.start_frame()
+			perceive(game)
+			game.location.scheduler.run(game, game.player.action_time(), batch_turn if BATCH_AI else None)
+			game.planner.end_frame()
+		elif game.game_state == 'playing':
+			game.planner.idle()
  
 def main_menu():
 	"show main game menu with 3 options: start new game, continue previous game, quit"
@@ -69,8 +85,10 @@ def main_menu():
 		#show options and wait for the player's choice
 		choice = menu('', ['Start', 'Continue', 'Quit'], 24)
 
+		#the previous game is replaced, so its worker process is stopped
 		if choice == 0:
 			game = new_game()
+			close_game(played_game)
 			played_game = play_game(game)
 		elif choice == 1:
 			try:
@@ -78,6 +96,7 @@ def main_menu():
 			except:
 				msgbox('\n No saved game to load. \n', 24)
 				continue
+			close_game(played_game)
 			played_game = play_game(last_game)
 		elif choice == 2:
 			if played_game is not None:
@@ -87,6 +106,9 @@ def main_menu():
 			print "Exiting the game..."
 			break
 
+	#the window has been closed without saving
+	close_game(played_game)
+
 def save_game(game):
 	"save game data to the file using 'shelve'"
 	print "Saving current game..."
@@ -104,17 +126,20 @@ def save_game(game):
 	for char in level.characters:
 		char.pos = None
 		char.entire_map = None
-		char.fov = None
 	for item in level.items:
 		item.pos = None
 	for obj in level.environment:
 		obj.pos = None
+	level.release_fov()
 	game.player.entire_map = None
 	game.player.pos = None
-	game.player.fov = None
+	game.player.release_fov()
 
-	#also delete references to consols
+	#also delete references to consols and stop generating levels in the background
 	game.consols = {}
+	game.rendered = None
+	game.pregen.close()
+	game.pregen = None
 
 	#save necessary information to the 'savegame' file
 	save_file = shelve.open('savegame', 'n')
@@ -160,13 +185,24 @@ def load_game():
 	#initialize new consols
 	map_console = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)
 	panel_console = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
-	game.consols = {'map': map_console, 'panel': panel_console}
+	scroll_console = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)
+	game.consols = {'map': map_console, 'panel': panel_console, 'scroll': scroll_console}
+	game.rendered = None
+
+	#resume building the next level
+	game.pregen = LevelPregenerator(game.seed)
+	if level.level - 1 not in game.levels:
+		game.pregen.request(level.level - 1)
 
 	print "Previous game was sucessfully loaded..."
 	return game
 
-libtcod.console_set_custom_font('dejavu12x12_gs_tc.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
-libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Breakdown', False)
-libtcod.sys_set_fps(LIMIT_FPS) #set FPS limit
+#levels are generated in the worker process, that imports this module on some platforms, so the game starts only in the main one
+if __name__ == '__main__':
+	multiprocessing.freeze_support()
+
+	libtcod.console_set_custom_font('dejavu12x12_gs_tc.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
+	libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Breakdown', False)
+	libtcod.sys_set_fps(LIMIT_FPS) #set FPS limit
 
-main_menu()
+	main_menu()
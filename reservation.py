@@ -0,0 +1,72 @@
+from globs import *
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# ReservationTable
+# Moves of many characters, that are made at once
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+class ReservationTable:
+	"""
+		table of moves for a single turn: every mover claims the cells, it wants to step on, then conflicts are resolved
+		and all granted moves are committed together, so the result doesn't depend on the order, in which characters have decided
+		cells are indexes in the layers of the map; nothing on the map is changed before 'commit'
+	"""
+	def __init__(self, level_map):
+		"create empty table for the map (LayeredMap instance)"
+		self.level_map = level_map
+		self.claims = [] #tuples (priority, number, character, cells); the number keeps the order of claims with equal priority
+
+	def __len__(self):
+		return len(self.claims)
+
+	def claim(self, char, cells, priority = 0):
+		"claim the cells in order of preference; claims with lower 'priority' value are served first"
+		self.claims.append((priority, len(self.claims), char, cells))
+
+	def resolve(self):
+		"""
+			decide, which moves are made; returns dict {character: index of the cell, it steps on}
+			every cell is granted to the first claimant in order of priority, that hasn't got a cell yet; walls and characters,
+			that don't move, block cells; the cell of another mover can be taken only if it leaves it and doesn't swap places
+			with the claimant; movers, that can't leave their cells, stay there, and so may stop the movers behind them
+		"""
+		level_map = self.level_map
+		origins = dict((level_map.index(char.pos.x, char.pos.y), char) for (priority, number, char, cells) in self.claims)
+
+		granted = {}
+		taken = set()
+		for (priority, number, char, cells) in sorted(self.claims):
+			for i in cells:
+				if i not in taken and level_map.walkable[i] and (i in origins or not level_map.occupied[i]):
+					granted[char] = i
+					taken.add(i)
+					break
+
+		#moves into the cells, that aren't left, fail one after another, until all the rest are possible
+		changed = True
+		while changed:
+			changed = False
+			for (char, i) in granted.items():
+				occupant = origins.get(i)
+				if occupant is None or occupant is char:
+					continue
+				target = granted.get(occupant)
+				if target is None or target == level_map.index(char.pos.x, char.pos.y):
+					del granted[char]
+					changed = True
+		return granted
+
+	def commit(self):
+		"make all granted moves at once and clear the table; returns the list of characters, that have moved, in order of their claims"
+		granted = self.resolve()
+		level_map = self.level_map
+		for char in granted:
+			char.pos.occupied = False
+		moved = [char for (priority, number, char, cells) in sorted(self.claims) if char in granted]
+		for char in moved:
+			i = granted[char]
+			char.step_to(level_map[i % level_map.width + level_map.x0][i / level_map.width + level_map.y0])
+		self.claims = []
+		return moved
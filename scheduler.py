@@ -0,0 +1,66 @@
+import heapq
+from globs import *
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# Scheduler
+# Time-based order of turns of the characters and timed events
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+class Scheduler:
+	"""
+		queue of actors, ordered by the time of their next action; it's kept as a heap, so every action costs O(log n)
+		actor is any object with method 'act(game)', that returns delay until its next action, or None if it's done;
+		characters act every 'Character.action_time()' units of time, timed events (i. e. the end of confusion) act only once
+		the level's time goes on only when the player acts, and actors, that are not scheduled (i. e. dormant ones), cost nothing
+	"""
+	def __init__(self):
+		"create empty queue"
+		self.time = 0 #current time of the level
+		self.queue = [] #heap of tuples (time, number, actor); numbers keep the order of actors, scheduled at the same time
+		self.count = 0 #number of scheduled actions, the next one gets it as its number
+
+	def __len__(self):
+		return len(self.queue)
+
+	def schedule(self, actor, delay):
+		"schedule the action of the actor in 'delay' units of time from now, replacing its previous one"
+		self.count += 1
+		actor.turn = self.count #actions with other numbers are cancelled
+		heapq.heappush(self.queue, (self.time + delay, self.count, actor))
+
+	def cancel(self, actor):
+		"cancel scheduled action of the actor; it's just skipped, when its time comes"
+		actor.turn = None
+
+	def run(self, game, duration, batch = None):
+		"""
+			let the time go on for 'duration' units and perform all actions, that are due by then, in order of their time
+			if function 'batch' is given, actors, that are due at the same time, act together: 'batch(game, actors)'
+			takes their turns and returns the list of their delays, like 'act' does (see 'AI.batch_turn')
+		"""
+		end = self.time + duration
+		queue = self.queue
+		while queue and queue[0][0] <= end:
+			time = queue[0][0]
+			due = [] #tuples (number, actor); actors with other numbers have been cancelled or rescheduled
+			while queue and queue[0][0] == time:
+				(time, number, actor) = heapq.heappop(queue)
+				if actor.turn == number:
+					due.append((number, actor))
+
+			self.time = time
+			if batch is None:
+				for (number, actor) in due:
+					if actor.turn == number: #it could be cancelled by the previous actor
+						self.reschedule(actor, number, actor.act(game))
+			else:
+				for ((number, actor), delay) in zip(due, batch(game, [actor for (number, actor) in due])):
+					self.reschedule(actor, number, delay)
+		self.time = end
+
+	def reschedule(self, actor, number, delay):
+		"schedule the next action of the actor, that has just performed the action 'number', unless it has been cancelled or rescheduled meanwhile"
+		if delay is not None and actor.turn == number:
+			self.schedule(actor, delay)
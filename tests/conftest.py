@@ -0,0 +1,5 @@
+import os
+import sys
+
+#modules of the game lie in the root of the repository, next to libtcod library; tests are run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
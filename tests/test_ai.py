@@ -0,0 +1,43 @@
+import pytest
+import character
+import gamemap
+import AI
+from bench import AIBenchGame
+from globs import *
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# AI stages: the batch stage makes the same decisions as the reference one
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+def play(batch, turns = 5, seed = 3):
+	"""
+		let every second enemy of a small level see the player, that stands still, for several turns with the given AI stage
+		(see 'Scheduler.run'); returns the goals of all enemies and the player's position
+	"""
+	station_level = gamemap.StationLevel(FIRST_LEVEL, seed, False, (60, 40))
+	(x, y) = station_level.get_player_start_pos()
+	player = character.generate_player(station_level, x, y)
+	player.fighter.hp = player.fighter.max_hp = 10 ** 9
+	seers = station_level.characters[::2]
+	for char in station_level.characters:
+		station_level.wake(char)
+
+	game = AIBenchGame(station_level, player)
+	for turn in range(turns):
+		for char in station_level.active:
+			char.sees_player = char in seers
+		station_level.scheduler.run(game, player.action_time(), batch)
+	goals = [char.goal for char in station_level.characters]
+	station_level.release_fov()
+	return (goals, (player.pos.x, player.pos.y), len(seers))
+
+def test_reference_goals():
+	(goals, position, seers) = play(None)
+	assert seers > 0
+	assert goals == [position if k % 2 == 0 else None for k in range(len(goals))]
+
+@pytest.mark.skipif(not AI.numpy_available, reason = 'the batch stage needs numpy')
+def test_batch_goals():
+	assert play(AI.batch_turn) == play(None)
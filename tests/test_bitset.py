@@ -0,0 +1,50 @@
+import pickle
+from bitset import Bitset
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# Bitset: flags, slices, set operations and pickling
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+def make(size, cells):
+	"bitset with flags of the given cells set"
+	bits = Bitset(size)
+	for i in cells:
+		bits[i] = 1
+	return bits
+
+def test_flags():
+	bits = make(20, [0, 7, 8, 19])
+	assert [bits[i] for i in range(20)] == [1 if i in (0, 7, 8, 19) else 0 for i in range(20)]
+	bits[7] = 0
+	assert bits[7] == 0 and bits[8] == 1
+	assert bits.indexes() == [0, 8, 19]
+	assert bits.count() == 3
+
+def test_slices():
+	bits = make(20, [1, 2, 10])
+	assert bits[0:4] == bytearray([0, 1, 1, 0])
+	assert bits[::10] == bytearray([0, 1])
+	bits[8:12] = [1, 0, 0, 1]
+	assert bits.indexes() == [1, 2, 8, 11]
+
+def test_set_operations():
+	a = make(13, [0, 3, 12])
+	b = make(13, [3, 4])
+	assert (a & b).indexes() == [3]
+	assert (a | b).indexes() == [0, 3, 4, 12]
+	assert (a - b).indexes() == [0, 12]
+	#the flags beyond the size are never set
+	assert (~a).indexes() == [1, 2, 4, 5, 6, 7, 8, 9, 10, 11]
+
+def test_set_all_and_clear_all():
+	bits = Bitset(11)
+	bits.set_all()
+	assert bits.count() == 11 and bits == ~Bitset(11)
+	bits.clear_all()
+	assert bits.indexes() == [] and bits == Bitset(11)
+
+def test_pickling():
+	bits = make(30, [2, 17, 29])
+	assert pickle.loads(pickle.dumps(bits, 2)) == bits
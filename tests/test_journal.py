@@ -0,0 +1,56 @@
+import pickle
+from journal import ChangeJournal
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# ChangeJournal: revisions, forgotten changes and 'changes_since' bounds
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+def make(size, count, layer = 'walkable'):
+	"journal, that keeps 'size' changes, with 'count' changes of cells 0, 1, 2... recorded"
+	journal = ChangeJournal(size)
+	for i in range(count):
+		journal.record(layer, i)
+	return journal
+
+def test_changes_since():
+	journal = make(10, 4)
+	assert journal.revision == 4
+	assert journal.changes_since(0) == [('walkable', 0), ('walkable', 1), ('walkable', 2), ('walkable', 3)]
+	assert journal.changes_since(2) == [('walkable', 2), ('walkable', 3)]
+	assert journal.changes_since(4) == []
+
+def test_overflow():
+	journal = make(3, 5)
+	#only the changes with revisions 3, 4 and 5 are kept
+	assert journal.base == 2
+	assert journal.changes_since(1) is None
+	assert journal.changes_since(2) == [('walkable', 2), ('walkable', 3), ('walkable', 4)]
+	assert journal.changes_since(4) == [('walkable', 4)]
+	assert journal.changes_since(5) == []
+
+def test_invalidate():
+	journal = make(10, 3)
+	journal.invalidate(['walkable', 'transparent'])
+	assert journal.revision == 4
+	assert journal.changes_since(3) is None
+	assert journal.changes_since(4) == []
+	assert journal.layer_revision('transparent') == 4
+
+def test_layer_revision():
+	journal = make(10, 2)
+	journal.record('occupied', 5)
+	assert journal.layer_revision('walkable') == 2
+	assert journal.layer_revision('occupied') == 3
+	assert journal.layer_revision('walkable', 'occupied') == 3
+	assert journal.layer_revision('explored') == 0
+
+def test_pickling():
+	#changes aren't saved, so everything derived from the map is rebuilt after loading
+	journal = pickle.loads(pickle.dumps(make(10, 3), 2))
+	assert journal.revision == 3
+	assert journal.changes_since(2) is None
+	assert journal.changes_since(3) == []
+	journal.record('walkable', 7)
+	assert journal.changes_since(3) == [('walkable', 7)]
@@ -0,0 +1,115 @@
+from reservation import ReservationTable
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# ReservationTable: conflicts, chains of movers and swaps
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+class Tile(object):
+	"the smallest stand-in for the map block, the character stands on"
+	def __init__(self, level_map, x, y):
+		self.level_map = level_map
+		self.x = x
+		self.y = y
+
+	def set_occupied(self, value):
+		self.level_map.occupied[self.level_map.index(self.x, self.y)] = 1 if value else 0
+
+	occupied = property(None, set_occupied)
+
+class Column:
+	def __init__(self, level_map, x):
+		self.level_map = level_map
+		self.x = x
+
+	def __getitem__(self, y):
+		return Tile(self.level_map, self.x, y)
+
+class Map:
+	"""
+		the smallest stand-in for LayeredMap: a row of cells 0..width-1 with walls in 'walls'
+		its top-left cell is (10, 20), so conversions between indexes and coordinates are checked as well
+	"""
+	x0 = 10
+	y0 = 20
+
+	def __init__(self, width, walls = ()):
+		self.width = width
+		self.walkable = bytearray(0 if i in walls else 1 for i in range(width))
+		self.occupied = bytearray(width)
+
+	def index(self, x, y):
+		return (y - self.y0) * self.width + x - self.x0
+
+	def __getitem__(self, x):
+		return Column(self, x)
+
+class Char:
+	"character, that stands on the cell 'i' of the map"
+	def __init__(self, level_map, i):
+		self.pos = level_map[i + level_map.x0][level_map.y0]
+		self.pos.occupied = True
+
+	def step_to(self, destination):
+		self.pos = destination
+		self.pos.occupied = True
+
+def cell(char):
+	return char.pos.level_map.index(char.pos.x, char.pos.y)
+
+def test_conflict():
+	level_map = Map(5)
+	(near, far) = (Char(level_map, 0), Char(level_map, 4))
+	table = ReservationTable(level_map)
+	table.claim(far, [2, 3], priority = 2)
+	table.claim(near, [2, 1], priority = 1)
+	#the claim with lower priority value is served first, the other character gets its second choice
+	assert table.resolve() == {near: 2, far: 3}
+
+def test_walls_and_standing_characters():
+	level_map = Map(5, walls = [1])
+	(mover, stander) = (Char(level_map, 0), Char(level_map, 2))
+	table = ReservationTable(level_map)
+	table.claim(mover, [1, 2])
+	assert table.resolve() == {}
+
+def test_chain():
+	level_map = Map(5)
+	(first, second, third) = (Char(level_map, 2), Char(level_map, 1), Char(level_map, 0))
+	table = ReservationTable(level_map)
+	#the ones behind take the cells, that are left by the ones before them, whatever the order of claims is
+	table.claim(third, [1])
+	table.claim(second, [2])
+	table.claim(first, [3])
+	assert table.resolve() == {first: 3, second: 2, third: 1}
+
+def test_blocked_chain():
+	level_map = Map(5, walls = [3])
+	(first, second, third) = (Char(level_map, 2), Char(level_map, 1), Char(level_map, 0))
+	table = ReservationTable(level_map)
+	table.claim(first, [3])
+	table.claim(second, [2])
+	table.claim(third, [1])
+	#the first one can't move, so nobody behind it can
+	assert table.resolve() == {}
+
+def test_swap():
+	level_map = Map(5)
+	(left, right) = (Char(level_map, 1), Char(level_map, 2))
+	table = ReservationTable(level_map)
+	table.claim(left, [2])
+	table.claim(right, [1])
+	assert table.resolve() == {}
+
+def test_commit():
+	level_map = Map(6)
+	(first, second, stander) = (Char(level_map, 2), Char(level_map, 1), Char(level_map, 5))
+	table = ReservationTable(level_map)
+	table.claim(second, [2], priority = 2)
+	table.claim(first, [3], priority = 1)
+	table.claim(stander, [4, 3], priority = 3)
+	assert table.commit() == [first, second, stander]
+	assert (cell(first), cell(second), cell(stander)) == (3, 2, 4)
+	assert list(level_map.occupied) == [0, 0, 1, 1, 1, 0]
+	assert len(table) == 0
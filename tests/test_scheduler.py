@@ -0,0 +1,93 @@
+from scheduler import Scheduler
+
+#-----------------------------
+#~~~~~~~~~~~~~~~~~~~~~~~
+# Scheduler: order of turns, lazy cancellation and batches
+#~~~~~~~~~~~~~~~~~~~~~~~
+#-----------------------------
+
+class Actor:
+	"acts every 'delay' units of time and writes down when it has acted"
+	turn = None
+
+	def __init__(self, name, delay, log):
+		self.name = name
+		self.delay = delay
+		self.log = log
+
+	def act(self, game):
+		self.log.append(self.name)
+		return self.delay
+
+def test_order():
+	log = []
+	scheduler = Scheduler()
+	(fast, slow, other) = (Actor('fast', 50, log), Actor('slow', 100, log), Actor('other', 100, log))
+	for actor in (slow, fast, other):
+		scheduler.schedule(actor, actor.delay)
+	scheduler.run(None, 200)
+	#actors, that are due at the same time, act in order of scheduling
+	assert log == ['fast', 'slow', 'other', 'fast', 'fast', 'slow', 'other', 'fast']
+	assert scheduler.time == 200
+
+def test_cancel():
+	log = []
+	scheduler = Scheduler()
+	(first, second) = (Actor('first', 100, log), Actor('second', 100, log))
+	scheduler.schedule(first, 100)
+	scheduler.schedule(second, 100)
+	scheduler.cancel(first)
+	#cancelled action stays in the queue, it's just skipped
+	assert len(scheduler) == 2
+	scheduler.run(None, 300)
+	assert log == ['second'] * 3
+	assert first.turn is None
+
+def test_reschedule():
+	log = []
+	scheduler = Scheduler()
+	actor = Actor('actor', 100, log)
+	scheduler.schedule(actor, 100)
+	scheduler.schedule(actor, 30) #replaces the previous action
+	scheduler.run(None, 100)
+	assert log == ['actor']
+	scheduler.run(None, 30)
+	assert log == ['actor'] * 2
+
+def test_cancelled_by_another_actor():
+	log = []
+
+	class Killer(Actor):
+		def act(self, game):
+			scheduler.cancel(victim)
+			return Actor.act(self, game)
+
+	scheduler = Scheduler()
+	(killer, victim) = (Killer('killer', 100, log), Actor('victim', 100, log))
+	scheduler.schedule(killer, 100)
+	scheduler.schedule(victim, 100)
+	scheduler.run(None, 100)
+	assert log == ['killer']
+
+def test_finished_actor():
+	log = []
+	scheduler = Scheduler()
+	event = Actor('event', None, log) #timed event acts only once
+	scheduler.schedule(event, 10)
+	scheduler.run(None, 100)
+	assert log == ['event'] and len(scheduler) == 0
+
+def test_batch():
+	log = []
+	batches = []
+
+	def batch(game, actors):
+		batches.append([actor.name for actor in actors])
+		return [actor.act(game) for actor in actors]
+
+	scheduler = Scheduler()
+	for (name, delay) in (('a', 100), ('b', 50), ('c', 100)):
+		actor = Actor(name, delay, log)
+		scheduler.schedule(actor, delay)
+	scheduler.run(None, 100, batch)
+	assert batches == [['b'], ['a', 'c', 'b']]